@@ -0,0 +1,201 @@
+"""
+Benchmark of EXTRACT path computation
+
+Usage: python bench_extract.py [--scaling [Max workers]] [JSON Graph ...]
+Without graphs, the graphs in sample/large and Barabasi-Albert graphs of several sizes are used.
+With --scaling, computeExtract on a process pool is timed instead from 1 worker to the max (default: number of CPUs).
+The heap frontier of Extract.computeExtractSingle is compared with the original linear scan and
+with the vectorized kernel (METHOD_VECTOR), and the pre maps of all must be identical. The predecessor index (PathIndex) is compared with
+the dict of dicts it replaced by memory and by the time of getPaths (all paths and the top-10 paths by goodness).
+Saving and loading the persistent index (Extract.save / Extract.load) is timed against computing the paths.
+"""
+
+import sys
+import glob
+import time
+import json
+import shutil
+import tempfile
+from multiprocessing import cpu_count
+import networkx as nx
+from networkx.readwrite import json_graph
+
+from patternmatching.gray import rwr, extract
+from patternmatching.query.Condition import Condition
+
+
+def load_graph(graph_json):
+  with open(graph_json, "r") as f:
+    return json_graph.node_link_graph(json.load(f))
+
+
+class LinearScanExtract(extract.Extract):
+  """Extract with the original frontier (linear scan over a set for the vertex with the largest distance)
+  """
+
+  def computeExtractSingle(self, i):
+    pre = {i: i}
+    d = dict()
+    l = dict()
+    X = set()
+    V = {i}
+    d[i] = self.getRWR(i, i)
+    l[i] = 1
+
+    while V:
+      max_d = 0.0
+      u = None
+      for u_ in V:
+        if d[u_] > max_d:
+          max_d = d[u_]
+          u = u_
+      if u is None:
+        break
+      V.remove(u)
+      X.add(u)
+
+      if u in l:
+        if l[u] >= extract.MAX_LENGTH:
+          continue
+      else:
+        l[u] = 0
+
+      for v in self.g.neighbors(u):
+        if self.label is not None and not self.label in Condition.get_edge_labels(self.g, u, v).values():
+          continue
+        if not v in X:
+          V.add(v)
+        rw = self.getRWR(i, v)
+        lu = l[u]
+        dist = (rw + d[u] * lu) / (lu + 1)
+        if (not v in d) or (d[v] < dist):
+          d[v] = dist
+          l[v] = lu + 1
+          pre[v] = u
+    self.pre.set_row(i, pre)
+
+
+def same_pre(a, b):
+  return a.keys() == b.keys() and all(a[i] == b[i] for i in a)
+
+
+def dict_paths(pre, g, i):
+  """getPaths over a dict of predecessors (the layout before PathIndex)
+  """
+  paths = {}
+  for j in g.nodes():
+    if not j in pre:
+      continue
+    lst = list()
+    v = j
+    while v != i:
+      lst.append(v)
+      v = pre[v]
+    lst.reverse()
+    if lst:
+      paths[j] = lst
+  return paths
+
+
+def bench_paths(g, ext):
+  """Memory of the predecessors and time of getPaths from every source: dict of dicts vs. PathIndex
+  """
+  pre = dict((i, ext.pre[i]) for i in ext.pre)
+  dict_bytes = sys.getsizeof(pre) + sum(sys.getsizeof(d) for d in pre.values())
+  index_bytes = sys.getsizeof(ext.pre.rows) + sum(sys.getsizeof(row) for row in ext.pre.rows.values())
+  st = time.time()
+  for i in pre:
+    dict_paths(pre[i], g, i)
+  t_dict = time.time() - st
+  st = time.time()
+  for i in pre:
+    ext.getPaths(i)
+  t_index = time.time() - st
+  st = time.time()
+  for i in pre:
+    ext.getPaths(i, top_k=10)
+  t_top = time.time() - st
+  print("  pre dict %10d bytes  index %10d bytes (%4.1fx)  getPaths dict %7.3f sec  index %7.3f sec  top-10 %7.3f sec"
+        % (dict_bytes, index_bytes, dict_bytes / float(index_bytes), t_dict, t_index, t_top))
+
+
+def bench_store(g, r, ext):
+  """Time of saving the paths and of loading them into a new Extract (fingerprint included)
+  """
+  directory = tempfile.mkdtemp()
+  try:
+    st = time.time()
+    ext.save(directory)
+    t_save = time.time() - st
+    loaded = extract.Extract(g, r)
+    st = time.time()
+    ok = loaded.load(directory)
+    t_load = time.time() - st
+    print("  store save %7.3f sec  load %7.3f sec  same pre %s"
+          % (t_save, t_load, ok and same_pre(dict(ext.pre), dict(loaded.pre))))
+  finally:
+    shutil.rmtree(directory)
+
+
+def bench(g):
+  r = rwr.RWR_WCC(g, 0.7, 0.1)
+  r.rwr_all()
+  results = list()
+  for cls, method in ((LinearScanExtract, extract.METHOD_SEARCH), (extract.Extract, extract.METHOD_SEARCH),
+                      (extract.Extract, extract.METHOD_VECTOR)):
+    ext = cls(g, r, method=method)
+    st = time.time()
+    ext.computeExtract()
+    results.append((time.time() - st, ext.pre))
+  (t_scan, pre_scan), (t_heap, pre_heap), (t_vec, pre_vec) = results
+  print("  scan %8.3f sec  heap %8.3f sec  speedup %5.2fx  same pre %s"
+        % (t_scan, t_heap, t_scan / max(t_heap, 1.0e-9), same_pre(pre_scan, pre_heap)))
+  print("  vector %6.3f sec  speedup over heap %5.2fx  same pre %s"
+        % (t_vec, t_heap / max(t_vec, 1.0e-9), same_pre(pre_heap, pre_vec)))
+  bench_paths(g, ext)
+  bench_store(g, r, ext)
+
+
+def bench_scaling(g, max_workers):
+  """Time of computeExtract with 1 to max_workers worker processes (1: vectorized kernel in this process)
+  """
+  r = rwr.RWR_WCC(g, 0.7, 0.1)
+  r.rwr_all()
+  base = None
+  t_one = None
+  for processes in range(1, max_workers + 1):
+    ext = extract.Extract(g, r, processes=processes)
+    st = time.time()
+    ext.computeExtract()
+    elapsed = time.time() - st
+    if base is None:
+      base, t_one = ext.pre, elapsed
+    print("  %2d workers %8.3f sec  speedup %5.2fx  same pre %s"
+          % (processes, elapsed, t_one / max(elapsed, 1.0e-9), same_pre(base, ext.pre)))
+
+
+def main():
+  args = sys.argv[1:]
+  max_workers = None
+  if args and args[0] == "--scaling":
+    args = args[1:]
+    max_workers = cpu_count()
+    if args and args[0].isdigit():
+      max_workers = int(args[0])
+      args = args[1:]
+  if args:
+    graphs = [(path, load_graph(path)) for path in args]
+  else:
+    graphs = [(path, load_graph(path)) for path in sorted(glob.glob("sample/large/*.json"))]
+    graphs += [("BA(%d, 3)" % n, nx.barabasi_albert_graph(n, 3, seed=0)) for n in (1000, 3000)]
+
+  for name, g in graphs:
+    print("%s: %d nodes, %d edges" % (name, g.number_of_nodes(), g.number_of_edges()))
+    if max_workers is None:
+      bench(g)
+    else:
+      bench_scaling(g, max_workers)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,127 @@
+"""
+Benchmark of RWR computation methods of RWR_WCC
+
+Usage: python bench_rwr.py [--precision] [JSON Graph] [Number of sources]
+Without a graph, Barabasi-Albert graphs of several sizes are used.
+With --precision, stored score precisions are compared instead by memory and by the candidates
+chosen like GRayMultiple.neighbor_expander.
+"""
+
+import sys
+import time
+import json
+import random
+from math import log
+import numpy as np
+import networkx as nx
+from networkx.readwrite import json_graph
+from sklearn.preprocessing import normalize
+
+from patternmatching.gray import rwr
+
+
+def load_graph(graph_json):
+  with open(graph_json, "r") as f:
+    return json_graph.node_link_graph(json.load(f))
+
+
+def exact_scores(g, sources, restart_prob=0.7, tol=1.0e-14):
+  """Reference scores by power iteration until the L1 difference is below tol
+
+  :return: Dict of source --> destination --> score
+  """
+  nodes = list(g.nodes())
+  adj = nx.to_scipy_sparse_matrix(g, nodelist=nodes)
+  og = normalize(adj, norm='l1', axis=1).T.tocsr()
+  index = dict((n, idx) for idx, n in enumerate(nodes))
+  e = np.zeros((len(nodes), len(sources)))
+  e[[index[src] for src in sources], np.arange(len(sources))] = restart_prob
+  p = e.copy()
+  diff = 1.0
+  while diff > tol:
+    p_next = og.dot(p) * (1 - restart_prob) + e
+    diff = np.abs(p_next - p).sum(axis=0).max()
+    p = p_next
+  return dict((src, dict(zip(nodes, p[:, col].tolist()))) for col, src in enumerate(sources))
+
+
+def max_error(r, exact):
+  err = 0.0
+  for src, values in exact.items():
+    for dst, value in values.items():
+      err = max(err, abs(r.get_value(src, dst) - value))
+  return err
+
+
+def bench_methods(g, num_sources):
+  nodes = list(g.nodes())
+  random.seed(0)
+  sources = random.sample(nodes, min(num_sources, len(nodes)))
+  exact = exact_scores(g, sources)
+  for method in (rwr.METHOD_POWER, rwr.METHOD_BATCH, rwr.METHOD_SOLVE, rwr.METHOD_MC):
+    r = rwr.RWR_WCC(g, 0.7, 0.1, method=method, seed=0)
+    st = time.time()
+    r.rwr_set(sources)
+    elapsed = time.time() - st
+    print("  %-10s %8.3f sec  max error %.2e" % (method, elapsed, max_error(r, exact)))
+
+
+def best_candidates(r, i):
+  """Candidates j of i with the best log(RWR(i, j)), with the same tolerance as GRayMultiple.neighbor_expander
+  """
+  max_good = float('-inf')
+  best = []
+  for j in r.get_dsts(i):
+    if j == i:
+      continue
+    log_good = log(r.get_value(i, j) + 1.0e-10)
+    if log_good > max_good:
+      best = [j]
+      max_good = log_good
+    elif log_good >= max_good - 1.0e-5:
+      best.append(j)
+  return set(best)
+
+
+def top_k(r, i, k=10):
+  return set(sorted((j for j in r.get_dsts(i) if j != i), key=lambda j: -r.get_value(i, j))[:k])
+
+
+def bench_precision(g, num_sources):
+  nodes = list(g.nodes())
+  random.seed(0)
+  sources = random.sample(nodes, min(num_sources, len(nodes)))
+  base = None
+  for precision in (rwr.PRECISION_DOUBLE, rwr.PRECISION_SINGLE, rwr.PRECISION_LOG16):
+    r = rwr.RWR_WCC(g, 0.7, 0.1, precision=precision)
+    r.rwr_set(sources)
+    if base is None:
+      base = r
+    same_best = sum(best_candidates(r, i) == best_candidates(base, i) for i in sources)
+    overlap = sum(len(top_k(r, i) & top_k(base, i)) for i in sources) / float(sum(len(top_k(base, i)) for i in sources))
+    print("  %-8s %10d bytes  max error %.2e  same best candidates %5.1f%%  top-10 overlap %5.1f%%"
+          % (precision, r.store.nbytes(), max_error(r, dict((i, dict((j, base.get_value(i, j)) for j in base.get_dsts(i)))
+                                                              for i in sources)),
+             100.0 * same_best / len(sources), 100.0 * overlap))
+
+
+def main():
+  argv = sys.argv[1:]
+  bench = bench_methods
+  if argv and argv[0] == "--precision":
+    bench = bench_precision
+    argv = argv[1:]
+  argv = [sys.argv[0]] + argv
+  num_sources = int(argv[2]) if len(argv) > 2 else 200
+  if len(argv) > 1:
+    graphs = [(argv[1], load_graph(argv[1]))]
+  else:
+    graphs = [("BA(%d, 3)" % n, nx.barabasi_albert_graph(n, 3, seed=0)) for n in (500, 2000, 5000, 20000)]
+
+  for name, g in graphs:
+    print("%s: %d nodes, %d edges, %d sources" % (name, g.number_of_nodes(), g.number_of_edges(), num_sources))
+    bench(g, num_sources)
+
+
+if __name__ == "__main__":
+  main()
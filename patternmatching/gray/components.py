@@ -0,0 +1,78 @@
+"""
+Weakly connected components maintained incrementally with union-find (disjoint-set)
+
+Edges can only be added, so components only merge. Each component keeps the list of its members,
+and union by size moves the smaller list into the larger one.
+"""
+
+
+class WeakComponents:
+  """Weakly connected components of a graph under edge insertions
+  """
+
+  def __init__(self, g):
+    self.parent = dict()   # Node ID --> parent node ID
+    self.members = dict()  # Root node ID --> member node IDs
+    for n in g.nodes():
+      self.add_node(n)
+    for e in g.edges():
+      self.union(e[0], e[1])
+
+  def __iter__(self):
+    return iter(self.members.values())
+
+  def __len__(self):
+    return len(self.members)
+
+  def add_node(self, n):
+    if n not in self.parent:
+      self.parent[n] = n
+      self.members[n] = [n]
+
+  def find(self, n):
+    """Root of the component of n (unknown nodes become new singleton components)
+    """
+    if n not in self.parent:
+      self.add_node(n)
+      return n
+    parent = self.parent
+    while parent[n] != n:
+      parent[n] = parent[parent[n]]  # Path halving
+      n = parent[n]
+    return n
+
+  def union(self, u, v):
+    """Merge the components of u and v
+
+    :return: Tuple of the surviving root and the absorbed root, or None if already connected
+    """
+    ru = self.find(u)
+    rv = self.find(v)
+    if ru == rv:
+      return None
+    if len(self.members[ru]) < len(self.members[rv]):
+      ru, rv = rv, ru
+    self.parent[rv] = ru
+    self.members[ru].extend(self.members.pop(rv))
+    return ru, rv
+
+  def component(self, n):
+    return self.members[self.find(n)]
+
+  def add_edges(self, edges):
+    """Add edges and report the components they touched
+
+    :param edges: Iterable of edges (only the first two elements of each edge are used)
+    :return: Dict of root --> set of former roots merged into it (a single root if nothing merged)
+    """
+    changed = dict()  # Root --> former roots
+    for e in edges:
+      for n in e[:2]:
+        r = self.find(n)
+        if r not in changed:
+          changed[r] = {r}
+      merged = self.union(e[0], e[1])
+      if merged is not None:
+        root, absorbed = merged
+        changed[root] = changed.get(root, {root}) | changed.pop(absorbed)
+    return changed
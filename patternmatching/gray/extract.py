@@ -6,22 +6,52 @@ Proceedings of the 12th ACM SIGKDD international conference on Knowledge discove
 """
 
 
+from collections import OrderedDict
+
+import numpy as np
+
 from patternmatching.query.Condition import *
-from patternmatching.gray.rwr import RWR_WCC
+from patternmatching.gray.rwr import RWR_WCC, BATCH_BYTES
+from patternmatching.gray.frontier import Frontier
+from patternmatching.gray.path_index import PathIndex
+from patternmatching.gray.label_adjacency import LabelAdjacency
+from patternmatching.gray.extract_vector import adjacency_csr, extract_batch, fill_scores, fill_sparse, sparse_rows, \
+  vectorizable, SPARSE_BATCH
+from patternmatching.gray.extract_parallel import extract_parallel
+from patternmatching.gray import path_mmap
 
 MAX_LENGTH = 3
+METHOD_SEARCH = "search"  # Best-first search from each source (computeExtractSingle)
+METHOD_VECTOR = "vector"  # Batches of sources with extract_vector (same paths, MAX_LENGTH <= 3)
 
 class Extract:
   
-  def __init__(self, g, rwr, label=None):
+  def __init__(self, g, rwr, label=None, lazy=False, cache_rows=None, adjacency=None, method=METHOD_VECTOR,
+               processes=1):
     """
     :type rwr: RWR_WCC
+    :param adjacency: LabelAdjacency of g shared with other labels (built for this instance if None)
+    :param lazy: Compute the paths from a source on its first getPath or getPaths
+    :param cache_rows: Maximum number of sources whose paths are kept in lazy mode (least recently used first evicted, None: unbounded)
+    :param method: Method of computeExtract (METHOD_SEARCH or METHOD_VECTOR)
+    :param processes: Number of worker processes of computeExtract (more than one: vectorized kernel on a process pool)
     """
-    self.pre = dict()
+    self.pre = PathIndex(g)  ## Source --> vertex --> predecessor on the best path
     self.rwr = rwr
     self.g = g
     self.label = label
+    if label is not None and adjacency is None:
+      adjacency = LabelAdjacency(g)
+    self.adjacency = adjacency
     self.default_value = 1.0 / self.g.number_of_nodes()
+    self.lazy = lazy
+    self.cache_rows = None if cache_rows is None else max(1, cache_rows)
+    self.recent = OrderedDict()  ## Sources with paths in lazy mode (least recently used first)
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.method = method
+    self.processes = processes
   
   def getRWR(self, i, j):
     return self.rwr.get_value(i, j)
@@ -29,34 +59,117 @@ class Extract:
   
   def computeExtract(self):
     # self.computeRWR()
+    if self.processes is not None and self.processes > 1:
+      self.computeExtractParallel(list(self.g.nodes()))
+      return
+    if self.method == METHOD_VECTOR:
+      self.computeExtractVector(list(self.g.nodes()))
+      return
     for i in self.g.nodes():
-      self.pre[i] = {}
-      self.pre[i][i] = i
       self.computeExtractSingle(i)
       # print i, self.pre[i]
 
+  def computeExtractVector(self, sources):
+    """Compute the paths from the sources in batches over the CSR adjacency (same paths as computeExtractSingle)
+    """
+    if not vectorizable(self.rwr, MAX_LENGTH):
+      for i in sources:
+        self.computeExtractSingle(i)
+      return
+    
+    indptr, indices = self._csr()
+    index = self.pre.index
+    n = len(indptr) - 1
+    columns = dict()  ## id(NodeIndex) --> (NodeIndex, indices of its nodes in the node list)
+    sparse = sparse_rows(self.rwr)  ## Only the stored scores are gathered (no dense rows)
+    width = SPARSE_BATCH if sparse else max(1, BATCH_BYTES // (8 * max(n, 1)))  ## Sources per batch
+    for st in range(0, len(sources), width):
+      batch = sources[st:st + width]
+      if sparse:
+        scores = fill_sparse(self.rwr, batch, index, n, columns)
+      else:
+        scores = np.empty((len(batch), n))
+        fill_scores(self.rwr, batch, index, scores, columns)
+      self._set_results(batch, extract_batch(indptr, indices, scores, [index[i] for i in batch], MAX_LENGTH))
+
+  def computeExtractParallel(self, sources):
+    """Compute the paths from the sources with the vectorized kernel on a process pool
+    """
+    if not vectorizable(self.rwr, MAX_LENGTH):
+      for i in sources:
+        self.computeExtractSingle(i)
+      return
+    
+    indptr, indices = self._csr()
+    results = extract_parallel(self.rwr, self.g, self.label, indptr, indices, self.pre.node_list(), sources,
+                               MAX_LENGTH, self.processes)
+    self._set_results(sources, [result[:2] for result in results])
+
+  def _csr(self):
+    """CSR adjacency over the node list of the path index (edges with the label only)
+    """
+    if self.label is None:
+      neighbors = lambda u: self.g.neighbors(u) if u in self.g else ()
+    else:
+      neighbors = lambda u: self.adjacency.neighbors(self.label, u)
+    return adjacency_csr(self.pre.node_list(), neighbors)
+
+  def _set_results(self, sources, results):
+    for i, result in zip(sources, results):
+      if result is None:  ## Searched one by one
+        self.computeExtractSingle(i)
+        continue
+      self.pre.set_row_indices(i, *result)
+      if self.lazy:
+        self._remember(i)
+
+  def key(self, fingerprint=None):
+    """Key of the paths in a persistent index (graph fingerprint, label and MAX_LENGTH)
+
+    :param fingerprint: path_mmap.graph_fingerprint of g and the RWR parameters (computed if None)
+    """
+    if fingerprint is None:
+      fingerprint = path_mmap.graph_fingerprint(self.g, self.rwr.params())
+    return path_mmap.make_key(fingerprint, self.label, MAX_LENGTH)
+
+  def save(self, directory, fingerprint=None):
+    """Save the paths into the cache directory (see path_mmap)
+
+    :return: Index directory
+    """
+    key = self.key(fingerprint)
+    path = path_mmap.key_path(directory, key)
+    path_mmap.save_index(self.pre, path, key)
+    return path
+
+  def load(self, directory, fingerprint=None, mmap_mode="c"):
+    """Open the paths saved for the same key in the cache directory (rows are memory-mapped, not read)
+
+    :return: True if a valid index was found and loaded
+    """
+    key = self.key(fingerprint)
+    path = path_mmap.key_path(directory, key)
+    meta = path_mmap.read_meta(path)
+    if meta is None or meta["key"] != key:
+      return False
+    nodes, rows, _ = path_mmap.load_index(path, mmap_mode=mmap_mode)
+    self.pre.set_rows(nodes, rows)
+    return True
+
   def computeExtractSingle(self, i):
+    pre = {i: i}   ## Predecessors
     d = dict()   ## Distance
     l = dict()   ## Hops
     X = set()   ## Finished set
-    V = {i}
     d[i] = self.getRWR(i, i)
     l[i] = 1
-    for u in V:
-      if i != u:
-        d[u] = 0
-        l[u] = 0
+    V = Frontier(d)  ## Frontier ordered by distance
+    V.add(i)
     
     while V:
-      max_d = 0.0
-      u = None # V[0]
-      for u_ in V:
-        if d[u_] > max_d:
-          max_d = d[u_]
-          u = u_
+      u = V.pop()
       if u is None:  # Not found
-        return
-      V.remove(u)
+        break
       X.add(u)
       
       if u in l:
@@ -65,9 +178,8 @@ class Extract:
       else:
         l[u] = 0
       
-      for v in self.g.neighbors(u):
-        if self.label is not None and not self.label in Condition.get_edge_labels(self.g, u, v).values():
-          continue
+      neighbors = self.g.neighbors(u) if self.label is None else self.adjacency.neighbors(self.label, u)
+      for v in neighbors:
         if not v in X:
           V.add(v)
         rw = self.getRWR(i, v)
@@ -76,35 +188,65 @@ class Extract:
         if (not v in d) or (d[v] < dist):
           d[v] = dist
           l[v] = lu + 1
-          self.pre[i][v] = u
+          pre[v] = u
+          V.update(v)
+    self.pre.set_row(i, pre)
+    if self.lazy:
+      self._remember(i)
+  
+  def _remember(self, i):
+    """Mark the paths from i as most recently used, and evict the least recently used sources over cache_rows
+    """
+    self.recent[i] = None
+    self.recent.move_to_end(i)
+    while self.cache_rows is not None and len(self.recent) > self.cache_rows:
+      old, _ = self.recent.popitem(last=False)
+      self.pre.remove(old)
+      self.evictions += 1
+  
+  def _require(self, i):
+    """Compute the paths from i if they are not stored (lazy mode)
+    """
+    if i in self.pre:
+      self.hits += 1
+      self._remember(i)
+    elif i in self.g:
+      self.misses += 1
+      self.computeExtractSingle(i)
+  
+  def cache_stats(self):
+    """Statistics of sources in lazy mode
+    """
+    return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "rows": len(self.recent),
+            "bytes": self.pre.nbytes()}
   
   ## Extract the best path i -> j
   def getPath(self, i, j):
-    lst = list()
-    if not i in self.pre:
-      return lst
-    if not j in self.pre[i]:
-      return lst
-    v = j
-    while v != i:
-      lst.append(v)
-      if not v in self.pre[i]:
-        return []
-      v = self.pre[i][v]
-    lst.reverse()
-    # print i, j, lst
-    return lst
+    if self.lazy:
+      self._require(i)
+    return self.pre.get_path(i, j)
 
   ## Extract the best paths from i
-  def getPaths(self, i):
-    paths = {}
-    if not i in self.pre:
-      return paths
-    for j in self.g.nodes():
-      if not j in self.pre[i]:
-        continue
-      path = self.getPath(i, j)
-      if path:
-        paths[j] = path
+  def getPaths(self, i, ordered=False, top_k=None):
+    """
+    :param ordered: Order the paths by goodness (best first) instead of by node order
+    :param top_k: Return only the top-k paths by goodness
+    """
+    if self.lazy:
+      self._require(i)
+    paths = self.pre.get_paths(i)
+    if ordered or top_k is not None:
+      goodness = self.getGoodness(i, paths)
+      ranked = sorted(paths, key=lambda j: -goodness[j])[:top_k]  # Stable: ties in the node order
+      paths = dict((j, paths[j]) for j in ranked)
     return paths
 
+  ## Goodness of the best paths from i (the distance of EXTRACT: the mean RWR score from i over each path)
+  def getGoodness(self, i, paths):
+    d = {i: self.getRWR(i, i)}
+    for j in sorted(paths, key=lambda j: len(paths[j])):  # Prefixes first
+      path = paths[j]
+      u = path[-2] if len(path) > 1 else i
+      lu = len(path)  # Vertices on the path i -> u
+      d[j] = (self.getRWR(i, j) + d[u] * lu)/(lu + 1)
+    return d
@@ -0,0 +1,128 @@
+"""
+Parallel EXTRACT computation over a process pool
+
+The parent saves the RWR scores in the memory-mappable store format (rwr_mmap) into a temporary
+directory and places the CSR adjacency in shared memory (as in rwr_parallel). Each worker opens the
+store once (the score arrays are mapped, not read), gathers the score rows of its block of sources
+itself and runs extract_batch, and searches the sources the kernel cannot decide with its own copy of
+the graph (the search breaks ties by node IDs, so it does not run over indices). The workers send back
+only the compact predecessor arrays (sorted target indices and predecessor indices, int32), and the
+parent merges them into the PathIndex.
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from patternmatching.gray.rwr import BATCH_BYTES
+from patternmatching.gray.rwr_parallel import _to_shared, _attach
+from patternmatching.gray.path_index import INDEX_DTYPE
+from patternmatching.gray.extract_vector import extract_batch, fill_scores, fill_sparse, sparse_rows, SPARSE_BATCH
+
+TASKS_PER_PROCESS = 4  # Blocks of sources per worker
+
+_state = dict()  # Scores, graph and search of each worker (set by _init_worker)
+
+
+def _init_worker(specs, store_path, graph_path, nodes, label, max_length):
+  """Attach the adjacency, open the RWR store and build the search of the worker
+  """
+  from patternmatching.gray.rwr import RWR_WCC  # Imported here to avoid a circular import
+  from patternmatching.gray.incremental.extract_incremental import Extract  # Search recording explored vertices
+  for spec in specs:
+    _attach(spec)
+  rwr = RWR_WCC.load(store_path)
+  g = rwr.g
+  if graph_path is not None:  # Paths over another graph than the scores
+    with open(graph_path, "rb") as rf:
+      g = pickle.load(rf)
+  _state.update(specs=specs, rwr=rwr, search=Extract(g, rwr, label), nodes=nodes,
+                index=dict((n, idx) for idx, n in enumerate(nodes)), columns=dict(), max_length=max_length)
+
+
+def _searched(i):
+  """Predecessor arrays and explored vertices of the search from i in the worker
+  """
+  search, index, nodes = _state["search"], _state["index"], _state["nodes"]
+  search.computeExtractSingle(i)
+  pre = search.pre[i]
+  explored = search.explored[i]
+  search._forget(i)
+  search.pre.remove(i)
+  targets = np.array(sorted(index[v] for v in pre), dtype=INDEX_DTYPE)
+  preds = np.array([index[pre[nodes[t]]] for t in targets.tolist()], dtype=INDEX_DTYPE)
+  return targets, preds, explored
+
+
+def _run_task(args):
+  """Paths from a block of sources (kernel first, then the search for the undecided sources)
+  """
+  st, rows = args
+  indptr, indices = [_attach(spec) for spec in _state["specs"]]
+  rwr, nodes, index, columns = _state["rwr"], _state["nodes"], _state["index"], _state["columns"]
+  sources = [nodes[k] for k in rows]
+  n = len(indptr) - 1
+  if sparse_rows(rwr):
+    scores = fill_sparse(rwr, sources, index, n, columns)
+  else:
+    scores = np.empty((len(sources), n))
+    fill_scores(rwr, sources, index, scores, columns)
+  results = extract_batch(indptr, indices, scores, rows, _state["max_length"])
+  return st, [_searched(i) if r is None else (r[0].astype(INDEX_DTYPE), r[1].astype(INDEX_DTYPE), None)
+              for i, r in zip(sources, results)]
+
+
+def extract_parallel(rwr_wcc, g, label, indptr, indices, nodes, sources, max_length, processes=None):
+  """Best-path predecessors from the sources computed on a process pool
+
+  :type rwr_wcc: patternmatching.gray.rwr.RWR_WCC
+  :param g: Graph of the paths
+  :param label: Edge label of the paths (None: all edges)
+  :param indptr: CSR offsets of the adjacency
+  :param indices: CSR neighbor indices of the adjacency
+  :param nodes: Node list of the adjacency (node ID of each index)
+  :param sources: List of source node IDs
+  :param max_length: Maximum number of vertices on a path
+  :param processes: Number of worker processes (None: number of CPUs)
+  :return: List of tuples (sorted target indices, predecessor indices, explored) for each source, where explored
+           is the list of vertices expanded by the search for the sources searched one by one (None otherwise)
+  """
+  processes = processes or cpu_count()
+  results = [None] * len(sources)
+  if not sources:
+    return results
+  index = dict((n, idx) for idx, n in enumerate(nodes))
+  n = len(indptr) - 1
+  width = SPARSE_BATCH if sparse_rows(rwr_wcc) else max(1, BATCH_BYTES // (8 * max(n, 1)))
+  width = min(width, -(-len(sources) // (processes * TASKS_PER_PROCESS)))  # Sources per task
+  tasks = [(st, np.array([index[i] for i in sources[st:st + width]], dtype=np.int64))
+           for st in range(0, len(sources), width)]
+
+  directory = tempfile.mkdtemp(prefix="extract_")
+  shms, specs = list(), list()
+  try:
+    store_path = os.path.join(directory, "rwr")
+    rwr_wcc.save(store_path)
+    graph_path = None
+    if g is not rwr_wcc.g:
+      graph_path = os.path.join(directory, "graph.pickle")
+      with open(graph_path, "wb") as wf:
+        pickle.dump(g, wf, protocol=pickle.HIGHEST_PROTOCOL)
+    for array in (np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int64)):
+      shm, spec = _to_shared(array)
+      shms.append(shm)
+      specs.append(spec)
+    with Pool(processes, initializer=_init_worker,
+              initargs=(specs, store_path, graph_path, nodes, label, max_length)) as pool:
+      for st, part in pool.imap_unordered(_run_task, tasks):
+        results[st:st + len(part)] = part
+  finally:
+    for shm in shms:
+      shm.close()
+      shm.unlink()
+    shutil.rmtree(directory, ignore_errors=True)
+  return results
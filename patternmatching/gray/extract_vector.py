@@ -0,0 +1,207 @@
+"""
+Vectorized EXTRACT over a CSR adjacency for a batch of sources
+
+With MAX_LENGTH = 3, the best-first search of Extract.computeExtractSingle from a source i expands i and
+then its neighbors u (2 hops). The distance of a neighbor is a(u) = (r(u) + r(i)) / 2 with the RWR scores
+r from i, and a neighbor is expanded unless a better path through another neighbor reached it first.
+That requires r(u) > (r(w) + r(i)) / 2 for neighbors u and w, which cannot happen while every neighbor
+has r(u) < r(i) / 2 (always the case with restart probability 0.7, since r(i) >= 0.7). Then all
+neighbors keep i as predecessor, and every other vertex x reached in 2 hops takes the neighbor with
+the largest a(u) as predecessor (distance (r(x) + 2 a(u)) / 3).
+
+These rules are evaluated for a batch of sources at once with NumPy over the 1-hop and 2-hop pairs.
+Sources where they may not hold (a large neighbor score, tied candidates whose order depends on the
+search, or nonpositive scores) are reported so that the caller searches them one by one.
+
+The scores are read only at the pairs, so rows of a SparseScoreStore are not expanded into dense rows
+(SparseRows): a batch costs the stored entries and the pairs instead of n per source.
+"""
+
+import numpy as np
+
+from patternmatching.gray.rwr_store import SparseScoreStore
+
+OVERRIDE_MARGIN = 1.0e-9  # Relative margin of the check r(u) < r(i) / 2 against rounding
+SPARSE_BATCH = 1024  # Sources per batch on sparse score rows (SparseRows)
+
+
+def adjacency_csr(nodes, neighbors):
+  """CSR arrays of the neighbors of the nodes
+
+  :param nodes: Node list (row order and column indices)
+  :param neighbors: Function of node ID --> iterable of neighbor IDs
+  :return: Tuple of indptr and indices
+  """
+  index = dict((n, idx) for idx, n in enumerate(nodes))
+  indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+  indices = list()
+  for idx, u in enumerate(nodes):
+    indices.extend(index[v] for v in neighbors(u))
+    indptr[idx + 1] = len(indices)
+  return indptr, np.array(indices, dtype=np.int64)
+
+
+def sparse_rows(rwr):
+  """Whether the score rows of rwr are read as SparseRows (fill_sparse) instead of dense rows (fill_scores)
+  """
+  return isinstance(rwr.store, SparseScoreStore)
+
+
+def vectorizable(rwr, max_length):
+  """Whether extract_batch finds the same paths as the search with the scores of rwr
+
+  Deeper searches are not vectorized, and decoded score vectors may differ from get_value in the last bit.
+  Truncated rows kept in a dense store are searched too: a dense row costs n per source for a few scores.
+  """
+  return max_length <= 3 and getattr(rwr.store, "codec", None) is None and (sparse_rows(rwr) or not rwr.is_truncated())
+
+
+def fill_scores(rwr, sources, index, scores, columns):
+  """Write the dense RWR score rows of the sources into the first rows of scores
+
+  :type rwr: patternmatching.gray.rwr.RWR_WCC
+  :param index: Dict of node ID --> column
+  :param columns: Dict of id(NodeIndex) --> (NodeIndex, columns of its nodes, mask of its nodes in index), kept between calls
+  """
+  for k, i in enumerate(sources):
+    scores[k] = 0.0
+    row = rwr.get_vector(i)
+    if row is None:
+      continue
+    node_index, vector = row
+    if id(node_index) not in columns:
+      cols = np.array([index.get(v, -1) for v in node_index.nodes], dtype=np.int64)
+      columns[id(node_index)] = (node_index, cols[cols >= 0], cols >= 0)  # Nodes out of the index are skipped
+    _, cols, known = columns[id(node_index)]
+    scores[k, cols] = vector[known]
+
+
+class SparseRows:
+  """Stored scores of a batch of sources (keys: row * n + column in ascending order)
+  """
+
+  def __init__(self, shape, keys, values):
+    self.shape = shape
+    self.keys = keys
+    self.values = values
+
+  def gather(self, rows, cols):
+    """Scores at the pairs of rows and columns (0.0 if not stored)
+    """
+    keys = rows * self.shape[1] + cols
+    if len(self.keys) == 0:
+      return np.zeros(len(keys))
+    pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+    return np.where(self.keys[pos] == keys, self.values[pos], 0.0)
+
+
+def fill_sparse(rwr, sources, index, n, columns):
+  """Stored RWR scores of the sources as SparseRows (rows of a SparseScoreStore are not densified)
+
+  :type rwr: patternmatching.gray.rwr.RWR_WCC
+  :param index: Dict of node ID --> column
+  :param n: Number of columns
+  :param columns: Dict of id(NodeIndex) --> (NodeIndex, column of each node or -1), kept between calls
+  :rtype: SparseRows
+  """
+  keys, values = list(), list()
+  for k, i in enumerate(sources):
+    row = rwr.get_sparse(i)
+    if row is None:
+      continue
+    node_index, local, vector = row
+    if id(node_index) not in columns:
+      columns[id(node_index)] = (node_index, np.array([index.get(v, -1) for v in node_index.nodes], dtype=np.int64))
+    cols = columns[id(node_index)][1][local]
+    known = cols >= 0  # Nodes out of the index are skipped
+    keys.append(k * n + cols[known])
+    values.append(vector[known])
+  keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+  values = np.concatenate(values).astype(np.float64) if values else np.zeros(0)
+  order = np.argsort(keys, kind="stable")
+  return SparseRows((len(sources), n), keys[order], values[order])
+
+
+def _gather(scores, rows, cols):
+  """Scores at the pairs of rows and columns of a dense array or SparseRows
+  """
+  if isinstance(scores, SparseRows):
+    return scores.gather(rows, cols)
+  return scores[rows, cols]
+
+
+def _ranges(starts, lengths):
+  """Concatenation of arange(start, start + length) for each pair
+  """
+  total = int(lengths.sum())
+  if total == 0:
+    return np.zeros(0, dtype=np.int64)
+  offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+  return np.arange(total, dtype=np.int64) + offsets
+
+
+def extract_batch(indptr, indices, scores, sources, max_length):
+  """Best-path predecessors from a batch of sources
+
+  :param indptr: CSR offsets of the adjacency
+  :param indices: CSR neighbor indices of the adjacency
+  :param scores: Dense array of RWR scores (one row per source, one column per node) or SparseRows
+  :param sources: Node indices of the sources
+  :param max_length: Maximum number of vertices on a path (Extract.MAX_LENGTH, at most 3)
+  :return: List of tuples (sorted target indices, predecessor indices) for each source,
+           or None for sources that must be searched one by one
+  """
+  sources = np.asarray(sources, dtype=np.int64)
+  num, n = scores.shape
+  rows = np.arange(num)
+  r_src = _gather(scores, rows, sources)
+  bad = r_src <= 0.0
+
+  ## Neighbors of the sources (expanded when max_length >= 2)
+  b1 = np.zeros(0, dtype=np.int64)
+  u1 = np.zeros(0, dtype=np.int64)
+  if max_length >= 2:
+    deg = indptr[sources + 1] - indptr[sources]
+    b1 = np.repeat(rows, deg)
+    u1 = indices[_ranges(indptr[sources], deg)]
+    keep = u1 != sources[b1]
+    b1, u1 = b1[keep], u1[keep]
+  r1 = _gather(scores, b1, u1)
+  a = (r1 + r_src[b1] * 1) / 2
+
+  ## Vertices 2 hops away take the neighbor with the largest distance
+  b2 = np.zeros(0, dtype=np.int64)
+  x2 = np.zeros(0, dtype=np.int64)
+  p2 = np.zeros(0, dtype=np.int64)
+  if max_length >= 3:
+    bad[b1[a <= 0.0]] = True
+    bad[b1[r1 * 2 >= r_src[b1] * (1.0 - OVERRIDE_MARGIN)]] = True
+    deg = indptr[u1 + 1] - indptr[u1]
+    pair = np.repeat(np.arange(len(u1)), deg)  # Index of the 1-hop pair of each 2-hop pair
+    x = indices[_ranges(indptr[u1], deg)]
+    b = b1[pair]
+    first_keys = np.sort(b1 * n + u1)
+    keys = b * n + x
+    pos = np.minimum(np.searchsorted(first_keys, keys), max(len(first_keys) - 1, 0))
+    in_first = first_keys[pos] == keys if len(first_keys) else np.zeros(len(keys), dtype=bool)
+    keep = (x != sources[b]) & ~in_first
+    pair, x, b, keys = pair[keep], x[keep], b[keep], keys[keep]
+    ad = a[pair]
+    order = np.lexsort((-ad, keys))
+    keys_s = keys[order]
+    head = np.ones(len(order), dtype=bool)
+    head[1:] = keys_s[1:] != keys_s[:-1]
+    tied = np.zeros(len(order), dtype=bool)
+    tied[1:] = ~head[1:] & head[:-1] & (ad[order][1:] == ad[order][:-1])  # Best candidates are tied
+    bad[b[order[tied]]] = True
+    sel = order[head]
+    b2, x2, p2 = b[sel], x[sel], u1[pair[sel]]
+
+  ## Rows of (source, target, predecessor) sorted by source and target
+  all_b = np.concatenate((rows, b1, b2))
+  all_t = np.concatenate((sources, u1, x2))
+  all_p = np.concatenate((sources, sources[b1], p2))
+  order = np.lexsort((all_t, all_b))
+  all_b, all_t, all_p = all_b[order], all_t[order], all_p[order]
+  bounds = np.searchsorted(all_b, np.arange(num + 1))
+  return [None if bad[k] else (all_t[bounds[k]:bounds[k + 1]], all_p[bounds[k]:bounds[k + 1]]) for k in range(num)]
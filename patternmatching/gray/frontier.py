@@ -0,0 +1,71 @@
+"""
+Best-first frontier of EXTRACT with a binary heap
+
+The frontier keeps the same set of vertices as the original linear scan (added and removed in the same
+order), so ties are broken exactly like the scan: the first vertex in set iteration order with the largest
+distance. The heap finds the largest distance, and the set is scanned only when it is tied.
+Entries of vertices that left the frontier or whose distance has increased since are skipped (lazy deletion).
+"""
+
+import heapq
+import itertools
+
+
+class Frontier:
+  """Vertices to be finished, ordered by distance (node ID --> distance in dist)
+  """
+
+  def __init__(self, dist):
+    """
+    :param dist: Dict of node ID --> distance, updated by the caller (distances only increase)
+    """
+    self.dist = dist
+    self.members = set()
+    self.heap = list()  # Tuples of (-distance, counter, node ID)
+    self.counter = itertools.count()
+
+  def __bool__(self):
+    return bool(self.members)
+
+  def __len__(self):
+    return len(self.members)
+
+  def __contains__(self, v):
+    return v in self.members
+
+  def add(self, v):
+    if v not in self.members:
+      self.members.add(v)
+      if v in self.dist:
+        heapq.heappush(self.heap, (-self.dist[v], next(self.counter), v))
+
+  def update(self, v):
+    """Notify that the distance of v has increased
+    """
+    if v in self.members:
+      heapq.heappush(self.heap, (-self.dist[v], next(self.counter), v))
+
+  def _valid(self, entry):
+    return entry[2] in self.members and self.dist[entry[2]] == -entry[0]
+
+  def pop(self):
+    """Remove and return the vertex with the largest positive distance (None if there is no such vertex)
+    """
+    heap = self.heap
+    while heap and not self._valid(heap[0]):
+      heapq.heappop(heap)
+    if not heap or -heap[0][0] <= 0.0:
+      return None
+    neg, _, u = heapq.heappop(heap)
+
+    while heap and (heap[0][2] == u or not self._valid(heap[0])):
+      heapq.heappop(heap)
+    if heap and heap[0][0] == neg:  # Tied: choose like the linear scan
+      for u_ in self.members:
+        if self.dist[u_] == -neg:
+          if u_ != u:
+            heapq.heappush(heap, (neg, next(self.counter), u))
+            u = u_
+          break
+    self.members.remove(u)
+    return u
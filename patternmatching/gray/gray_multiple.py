@@ -8,7 +8,9 @@ Proceedings of the 13th ACM SIGKDD international conference on Knowledge discove
 from math import log
 import time
 
-from patternmatching.gray import rwr, extract
+from patternmatching.gray import rwr, extract, path_mmap
+from patternmatching.gray.label_adjacency import LabelAdjacency
+from patternmatching.gray.match_state import QueryEdges, MatchState
 from patternmatching.query.Condition import *
 from patternmatching.query import QueryResult
 
@@ -72,16 +74,33 @@ def valid_result(result, query, nodemap):
 
 RESTART_PROB = 0.7
 OG_PROB = 0.1
+SEED_BATCH = 64  # Number of seeds whose RWR rows are prewarmed at once in lazy mode
 
 class GRayMultiple:
   """
   Class of basic G-Ray implementation (it outputs multiple patterns)
   """
   
-  def __init__(self, graph, query, directed, cond, time_limit):
+  def __init__(self, graph, query, directed, cond, time_limit, rwr_method=rwr.METHOD_BATCH, rwr_lazy=False,
+               rwr_cache_rows=None, rwr_processes=1, rwr_precision=rwr.PRECISION_DOUBLE, ext_lazy=False,
+               ext_cache_rows=None, path_top_k=None, ext_processes=1, ext_store=None):
+    """
+    :param rwr_lazy: Compute RWR rows on demand instead of all rows before the search
+    :param rwr_cache_rows: Maximum number of RWR rows kept in lazy mode (None: unbounded)
+    :param rwr_processes: Number of worker processes computing RWR rows
+    :param rwr_precision: Precision of stored RWR scores
+    :param ext_lazy: Compute EXTRACT paths from a vertex on demand instead of from all vertices before the search
+      (implied by rwr_lazy, since paths from all vertices need every RWR row)
+    :param ext_cache_rows: Maximum number of vertices whose paths are kept in lazy mode for each label (None: unbounded)
+    :param path_top_k: Expand only the top-k paths by goodness for each path edge of the query (None: all paths)
+    :param ext_processes: Number of worker processes computing EXTRACT paths
+    :param ext_store: Directory of persistent EXTRACT path indexes (paths of the same graph are loaded instead of computed)
+    """
     self.graph = graph
-    self.graph_rwr = rwr.RWR_WCC(graph, RESTART_PROB, OG_PROB)
+    self.graph_rwr = rwr.RWR_WCC(graph, RESTART_PROB, OG_PROB, method=rwr_method, lazy=rwr_lazy,
+                                 cache_rows=rwr_cache_rows, processes=rwr_processes, precision=rwr_precision)
     self.query = query
+    self.query_edges = QueryEdges(query)  ## Numbered query edges of the match states
     self.directed = directed
     self.results = dict() ## Seed ID, QueryResult
     self.approx = dict()  ## Seed ID, QueryResult
@@ -89,6 +108,12 @@ class GRayMultiple:
     self.num_exact = 0  # Number of exact patterns
     self.num_approx = 0  # Number of approximate patterns
     self.extracts = {}
+    self.label_adjacency = LabelAdjacency(graph)  ## Shared by the extracts of labeled edges
+    self.ext_lazy = ext_lazy or rwr_lazy
+    self.ext_cache_rows = ext_cache_rows
+    self.path_top_k = path_top_k
+    self.ext_processes = ext_processes
+    self.ext_store = ext_store
     self.cond = cond ## Complex condition
     self.time_limit = time_limit
     self.called = 0
@@ -101,7 +126,7 @@ class GRayMultiple:
     k = list(self.query.nodes())[0]
     kl = Condition.get_node_label(self.query, k)
     kp = Condition.get_node_props(self.query, k)
-    seeds = Condition.filter_nodes(self.graph, kl, kp)  # Find all candidates
+    seeds = list(Condition.filter_nodes(self.graph, kl, kp))  # Find all candidates
     # seeds = [s for s in self.graph.nodes() if self.get_node_label(self.graph, s) == kl]  # Find all candidates
     if not seeds:  ## No seed candidates
       logging.debug("No more seed vertices available. Exit G-Ray algorithm.")
@@ -110,32 +135,24 @@ class GRayMultiple:
       print("Number of seeds: %d" % len(seeds))
 
     st = time.time()  # Start time
-    for i in seeds:
+    batch = min(SEED_BATCH, self.graph_rwr.cache_rows or SEED_BATCH)  # Prewarmed rows must not evict each other
+    for idx, i in enumerate(seeds):
+      if self.graph_rwr.lazy and idx % batch == 0:
+        self.graph_rwr.prewarm(seeds[idx:idx + batch])
       self.called = 0
       self.current_seed = i
       
       if self.is_target():
         logging.info("#### Choose Seed: " + str(i) + " " + str(len(self.graph[i])))
-      result = nx.MultiDiGraph() if self.directed else nx.MultiGraph()
-
-      touched = []
-      nodemap = {}  ## Query Vertex -> Graph Vertex
-      unprocessed = self.query.copy()
-      # unprocessed = nx.MultiDiGraph(self.query) if self.directed else nx.MultiGraph(self.query)
-
       il = Condition.get_node_label(self.graph, i)
       props = Condition.get_node_props(self.graph, i)
-      nodemap[k] = i
-      result.add_node(i)
-      result.nodes[i][LABEL] = il
-      for name, value in props.items():
-        result.nodes[i][name] = value
+      attrs = {LABEL: il}  ## Attributes of the seed in the result
+      attrs.update(props)
 
       # logging.debug("## Mapping node: " + str(k) + " : " + str(i))
-      touched.append(k)
       
       # Start neighbor-expander and bridge
-      self.process_neighbors(result, touched, nodemap, unprocessed)
+      self.process_match(MatchState.start(self.query_edges, k, i, attrs))
       
       # print("Called %d times from %s with degree %d" % (self.called, str(i), self.graph.degree(i)))
       
@@ -152,9 +169,7 @@ class GRayMultiple:
     logging.info("#### Compute RWR: %f [s]" % (ed - st))
 
     st = time.time()
-    ext = extract.Extract(self.graph, self.graph_rwr)
-    ext.computeExtract()
-    self.extracts[''] = ext
+    self.extracts[''] = self.newExtract()
     ed = time.time()
     logging.info("#### Compute Paths: %f [s]" % (ed - st))
     
@@ -164,17 +179,34 @@ class GRayMultiple:
     self.process_gray()
     ed = time.time()
     logging.info("#### Compute G-Ray: %f [s]" % (ed - st))
+    if self.graph_rwr.lazy:
+      logging.info("#### RWR rows: %s" % str(self.graph_rwr.cache_stats()))
+    if self.ext_lazy:
+      for label, ext in self.extracts.items():
+        logging.info("#### Paths [%s]: %s" % (label, str(ext.cache_stats())))
     # pr.disable()
     # stats = pstats.Stats(pr)
     # stats.sort_stats('tottime')
     # stats.print_stats()
 
   
+  def newExtract(self, label=None):
+    ext = extract.Extract(self.graph, self.graph_rwr, label, lazy=self.ext_lazy, cache_rows=self.ext_cache_rows,
+                          adjacency=self.label_adjacency, processes=self.ext_processes)
+    if self.ext_store is not None:
+      fingerprint = path_mmap.graph_fingerprint(self.graph, self.graph_rwr.params())
+      if ext.load(self.ext_store, fingerprint):
+        logging.info("#### Paths [%s]: loaded from %s" % (label, self.ext_store))
+        return ext
+    if not self.ext_lazy:  # Paths are computed on demand in lazy mode
+      ext.computeExtract()
+      if self.ext_store is not None:
+        ext.save(self.ext_store, fingerprint)
+    return ext
+  
   def getExtract(self, label):
     if not label in self.extracts:
-      ext = extract.Extract(self.graph, self.graph_rwr, label)
-      ext.computeExtract()
-      self.extracts[label] = ext
+      self.extracts[label] = self.newExtract(label)
     return self.extracts[label]
 
   def append_results(self, result, nodemap):
@@ -198,17 +230,42 @@ class GRayMultiple:
 
   
   def process_neighbors(self, result, touched, nodemap, unproc):
+    """Continue the search from a partial match given as graphs (see process_match)
+    """
+    self.process_match(MatchState.from_graphs(self.query_edges, result, touched, nodemap, unproc))
+
+  def found_match(self, state):
+    """Register the match when all query edges are processed
+    
+    :type state: MatchState
+    """
+    nodemap = state.nodemap()
+    ## The result graph is built at most once (the state is checked first unless a mapped vertex was removed from it)
+    result = None if all(state.has_node(n) for n in nodemap.values()) else state.to_graph(self.graph)
+    if valid_result(state if result is None else result, self.query, nodemap):
+      logging.debug("###### Found pattern " + str(self.num_exact))
+      if self.append_results(state.to_graph(self.graph) if result is None else result, nodemap):
+        self.num_exact += 1
+    else:
+      self.found_invalid(state, result, nodemap)
+  
+  def found_invalid(self, state, result, nodemap):
+    """Handle a match whose result does not fit the query (ignored here)
+    
+    :type state: MatchState
+    :param result: Result graph of the state if already built (None otherwise)
+    """
+    logging.debug("No more edges available. Exit G-Ray algorithm.")
+  
+  def process_match(self, state):
+    """
+    :type state: MatchState
+    """
     self.called += 1
-    if unproc.number_of_edges() == 0:
-      if valid_result(result, self.query, nodemap):
-        logging.debug("###### Found pattern " + str(self.num_exact))
-        if self.append_results(result, nodemap):
-          self.num_exact += 1
-        return
-      else:
-        logging.debug("No more edges available. Exit G-Ray algorithm.")
-        return
-    if result.number_of_edges() > self.query.number_of_edges():
+    if state.complete():
+      self.found_match(state)
+      return
+    if state.number_of_edges() > self.query.number_of_edges():
       logging.debug("Too many edges. Exit G-Ray algorithm.")
       return
     
@@ -216,14 +273,13 @@ class GRayMultiple:
     l = None
     reversed_edge = False
     kl = None
-    for k_ in touched:
+    for k_ in state.touched:
       kl = Condition.get_node_label(self.query, k_)
       # kp = Condition.get_node_props(self.query, k_)
       
       ## Forward Edge
       for l_ in self.query.neighbors(k_):
-        # print k_, kl, kp, l_, unproc.edges()
-        if not unproc.has_edge(k_, l_):
+        if not state.has_query_edge(k_, l_):
           continue
         l = l_
         break
@@ -235,7 +291,7 @@ class GRayMultiple:
       ## Reversed Edge
       if self.directed:
         for l_ in self.query.predecessors(k_):
-          if not unproc.has_edge(l_, k_):
+          if not state.has_query_edge(l_, k_):
             continue
           l = l_
           break
@@ -252,13 +308,12 @@ class GRayMultiple:
     
     if self.is_target():
       logging.info("#### Start Processing Neighbors from " + str(k) + " count " + str(self.num_exact))
-      logging.info("## result: " + " ".join([str(e) for e in result.edges()]))
-      logging.info("## touchd: " + " ".join([str(n) for n in touched]))
-      logging.info("## nodemp: " + str(nodemap))
-      logging.info("## unproc: " + " ".join([str(e) for e in unproc.edges()]))
+      logging.info("## result: " + " ".join([str(e) for e in state.edges]))
+      logging.info("## touchd: " + " ".join([str(n) for n in state.touched]))
+      logging.info("## nodemp: " + str(state.nodemap()))
+      logging.info("## unproc: " + " ".join([str(e) for e in state.unprocessed()]))
     
-    i = nodemap[k]
-    touched.append(l)
+    i = state.get(k)
     ll = Condition.get_node_label(self.query, l)
     # lp = Condition.get_node_props(self.query, l)
     logging.debug("## Find the next vertex " + str(k) + "[" + kl + "] -> " + str(l) + "[" + ll + "]")
@@ -270,7 +325,7 @@ class GRayMultiple:
     #### Find a path or edge (Begin)
     src, dst = (l, k) if reversed_edge else (k, l)
     
-    elabel = Condition.get_edge_label(unproc, src, dst)
+    elabel = state.edge_label(src, dst)
     # print elabel
     if elabel is None:  # Any label is OK
       eid = None
@@ -278,41 +333,23 @@ class GRayMultiple:
     else:
       eid = elabel[0]
       el = elabel[1]
-    Condition.remove_edge_from_id(unproc, src, dst, eid)
+    state = state.advance(l, src, dst, eid)
     
     
     if is_path:
-      paths = self.getExtract(el).getPaths(i)
+      paths = self.getExtract(el).getPaths(i, top_k=self.path_top_k)
       if not paths:
         logging.info("No more paths available. Exit G-Ray algorithm.")
         return
       for j, path in paths.items():
-        result_ = nx.MultiDiGraph(result) if self.directed else nx.MultiGraph(result)
-        touched_ = list(touched)
-        nodemap_ = dict(nodemap)
-        unproc_ = nx.MultiDiGraph(unproc) if self.directed else nx.MultiGraph(unproc)
-    
-        if l in nodemap_ and nodemap_[l] != j:
-          prevj = nodemap_[l]
-          result_.remove_node(prevj)
-    
-        nodemap_[l] = j
-        props = Condition.get_node_props(self.graph, j)
-        result_.add_node(j)
-        for key, value in props.items():
-          result_.nodes[j][key] = value
-        
-        prev = i
-        for n in path:
-          result_.add_edge(prev, n)
-          prev = n
-        self.process_neighbors(result_, touched_, nodemap_, unproc_)
+        self.process_match(state.extend(l, j, i, path))
     
     else:
-      if l in nodemap:
-        jlist = [nodemap[l]]
+      lj = state.get(l)
+      if lj is not None:
+        jlist = [lj]
       else:
-        jlist = self.neighbor_expander(i, k, l, result, reversed_edge)  # find j(l) from i(k)
+        jlist = self.neighbor_expander(i, k, l, state, reversed_edge)  # find j(l) from i(k)
         if not jlist:  ## No more neighbor candidates
           logging.debug("No more neighbor vertices available. Exit G-Ray algorithm.")
           return
@@ -328,33 +365,15 @@ class GRayMultiple:
           continue
         logging.debug("## Find path from " + str(g_src) + " -> " + str(g_dst) + ": " + " ".join(str(n) for n in path))
         
-        result_ = nx.MultiDiGraph(result) if self.directed else nx.MultiGraph(result)
-        touched_ = list(touched)
-        nodemap_ = dict(nodemap)
-        unproc_ = nx.MultiDiGraph(unproc) if self.directed else nx.MultiGraph(unproc)
-    
-        if l in nodemap_ and nodemap_[l] != j:  ## Need to replace mapping
-          prevj = nodemap_[l]
-          result_.remove_node(prevj)
-        nodemap_[l] = j
-        props = Condition.get_node_props(self.graph, j)
-        result_.add_node(j)
-        # print props
-        for k, v in props.items():
-          result_.nodes[j][k] = v
-        # print result_.nodes(data=True)[j]
-        
         prev = g_src
         valid = True
         for n in path:
-          # print path, prev, n
           if not Condition.has_edge_label(self.graph, prev, n, el):
             valid = False
             break
-          result_.add_edge(prev, n)
           prev = n
         if valid:
-          self.process_neighbors(result_, touched_, nodemap_, unproc_)
+          self.process_match(state.extend(l, j, g_src, path))
     #### Find a path or edge (End)
     
   ## List of tuple (extracted graph and node map)
@@ -392,7 +411,7 @@ class GRayMultiple:
           log_sum = 0
           for j in nodes:
             if Condition.satisfies_node(self.graph, j, ll, lp):
-              log_sum += log(self.getRWR(j, i) / num)
+              log_sum += log(self.getInboundRWR(j, i) / num)
           log_good += log_sum / rwrs[l]
       
       # logging.debug("#### SeedFinder#log_good: " + str(i) + " " + str(log_good) + " max_good: " + str(max_good))
@@ -423,11 +442,11 @@ class GRayMultiple:
     candidates_j = self.get_connected(i) & set(candidates_j)
     
     for j_ in candidates_j:
-      if j_ in result.nodes() or j_ == i:
+      if result.has_node(j_) or j_ == i:
         continue
       
       if reversed_edge:
-        log_good = log(self.getRWR(j_, i) + 1.0e-10)  # avoid math domain errors when the vertex is unreachable
+        log_good = log(self.getInboundRWR(j_, i) + 1.0e-10)  # avoid math domain errors when the vertex is unreachable
         # logging.debug("#### NeighborExpander#log_good: " + str(i) + " <- " + str(j_) + " " + str(log_good))
       else:
         log_good = log(self.getRWR(i, j_) + 1.0e-10)  # avoid math domain errors when the vertex is unreachable
@@ -460,6 +479,8 @@ class GRayMultiple:
   
   
   def computeRWR(self):
+    if self.graph_rwr.lazy:  # Rows are computed on demand
+      return
     self.graph_rwr.rwr_set(self.graph.nodes())
     # st = time.time()  # Start time
     # for m in self.graph.nodes():
@@ -475,6 +496,10 @@ class GRayMultiple:
     #   return self.graph_rwr[m].get(n, 0.0)
     return self.graph_rwr.get_value(m, n)
   
+  def getInboundRWR(self, m, n):
+    ## Same as getRWR, but uses the cached column of n when the row of m has not been computed
+    return self.graph_rwr.get_inbound_value(m, n)
+  
   def get_connected(self, n):
     return set(self.graph_rwr.get_dsts(n))
   
@@ -484,9 +509,10 @@ class GRayMultiple:
   @staticmethod
   def rwr(g, m, n):  # Random walk with restart m -> n in g
     rw = rwr.RWR(g)
-    results = rw.run_exp(m, RESTART_PROB, OG_PROB)
-    logging.debug("RWR: " + str(m) + " -> " + str(n) + " " + str(results))
-    return results[n]
+    p = rw.run_vector(m, RESTART_PROB, OG_PROB)
+    result = float(p[rw.node_index.index[n]])
+    logging.debug("RWR: " + str(m) + " -> " + str(n) + " " + str(result))
+    return result
 
 
 
@@ -8,20 +8,33 @@ Proceedings of the 12th ACM SIGKDD international conference on Knowledge discove
 
 from patternmatching.query.Condition import *
 from patternmatching.gray.rwr import RWR_WCC
+from patternmatching.gray.frontier import Frontier
+from patternmatching.gray.path_index import PathIndex
+from patternmatching.gray.label_adjacency import LabelAdjacency
+from patternmatching.gray.extract_vector import adjacency_csr, vectorizable
+from patternmatching.gray.extract_parallel import extract_parallel
 
 MAX_LENGTH = 3
 
 class Extract:
   
-  def __init__(self, g, rwr, label=None):
+  def __init__(self, g, rwr, label=None, adjacency=None, processes=1):
     """
     :type rwr: RWR_WCC
+    :param adjacency: LabelAdjacency of g shared with other labels (built for this instance if None)
+    :param processes: Number of worker processes of computeExtract_batch (more than one: vectorized kernel on a process pool)
     """
-    self.pre = dict()
+    self.pre = PathIndex(g)  ## Source --> vertex --> predecessor on the best path
     self.rwr = rwr
     self.g = g
     self.label = label
+    if label is not None and adjacency is None:
+      adjacency = LabelAdjacency(g)
+    self.adjacency = adjacency
     self.default_value = 1.0 / g.number_of_nodes()
+    self.explored = dict()  ## Source --> vertices whose neighbors were expanded by the search from the source
+    self.expanded = dict()  ## Vertex --> sources whose searches expanded the neighbors of the vertex
+    self.processes = processes
   
   def getRWR(self, i, j):
     return self.rwr.get_value(i, j)
@@ -31,19 +44,73 @@ class Extract:
     
     :return:
     """
+    if self.processes is not None and self.processes > 1 and vectorizable(self.rwr, MAX_LENGTH):
+      self.computeExtractParallel(list(self.g.nodes()))
+      return
     for i in self.g.nodes():
-      self.pre[i] = dict()
-      self.pre[i][i] = i
       self.computeExtractSingle(i)
   
-  def computeExtract_incremental(self, nodes):
-    """Compute neighbors and paths for specified node set
+  def computeExtractParallel(self, sources):
+    """Compute paths from the sources with the vectorized kernel on a process pool
     
-    :param nodes: Node set for recomputations
-    :return:
+    :param sources: Node list
+    """
+    if self.label is None:
+      neighbors = lambda u: self.g.neighbors(u) if u in self.g else ()
+    else:
+      neighbors = lambda u: self.adjacency.neighbors(self.label, u)
+    indptr, indices = adjacency_csr(self.pre.node_list(), neighbors)
+    index = self.pre.index
+    results = extract_parallel(self.rwr, self.g, self.label, indptr, indices, self.pre.node_list(), sources,
+                               MAX_LENGTH, self.processes)
+    nodes = self.pre.nodes
+    for i, (targets, preds, explored) in zip(sources, results):
+      self._forget(i)
+      self.pre.set_row_indices(i, targets, preds)
+      if explored is None:
+        ## The search expands the source and its neighbors (the targets with the source as predecessor)
+        s = index[i]
+        explored = [i] + ([nodes[t] for t in targets[(preds == s) & (targets != s)].tolist()] if MAX_LENGTH >= 3 else [])
+      self.explored[i] = explored
+      for u in explored:
+        self.expanded.setdefault(u, set()).add(i)
+  
+  def computeExtract_incremental(self, nodes, edges=None):
+    """Compute neighbors and paths for specified node set, and for the sources whose searches expanded
+    an endpoint of the added edges
+    
+    :param nodes: Node set for recomputations (e.g. sources with updated RWR scores)
+    :param edges: Added edges (tuples of source, destination, ...)
+    :return: Set of recomputed sources
     """
-    for n in nodes:
+    recomp = set(nodes)
+    if edges is not None:
+      recomp |= self.affected_sources(edges)
+    for n in recomp:
       self.computeExtractSingle(n)
+    return recomp
+  
+  def affected_sources(self, edges):
+    """Sources whose best paths may change by adding the edges (their searches expanded a changed vertex)
+    
+    :param edges: Added edges (tuples of source, destination, ...)
+    :return: Set of sources
+    """
+    directed = self.g.is_directed()
+    sources = set()
+    for e in edges:
+      for v in (e[0],) if directed else (e[0], e[1]):  ## Vertices with new neighbors
+        sources |= self.expanded.get(v, set())
+    return sources
+  
+  def _forget(self, i):
+    """Remove the dependencies of the previous search from i
+    """
+    for u in self.explored.pop(i, ()):
+      sources = self.expanded[u]
+      sources.discard(i)
+      if not sources:
+        del self.expanded[u]
       
 
   def computeExtractSingle(self, i):
@@ -53,31 +120,22 @@ class Extract:
     :return:
     """
     # print("ComputeExtractSingle: " + str(i))
-    if i not in self.pre:
-      self.pre[i] = dict()
-      self.pre[i][i] = i
+    self._forget(i)
+    pre = {i: i}  ## Predecessors
+    explored = list()  ## Vertices whose neighbors are expanded
     
     dist = dict()   ## Distance score
     hops = dict()   ## Hops
     finished = set()   ## Finished set
-    V = {i}
     dist[i] = self.getRWR(i, i)
     hops[i] = 1
-    for u in V:
-      if i != u:
-        dist[u] = 0
-        hops[u] = 0
+    V = Frontier(dist)  ## Frontier ordered by distance
+    V.add(i)
     
     while V:
-      max_d = 0.0
-      u = None # V[0]
-      for u_ in V:
-        if dist[u_] > max_d:
-          max_d = dist[u_]
-          u = u_
+      u = V.pop()
       if u is None:
-        return
-      V.remove(u)
+        break
       finished.add(u)
       
       if u in hops:
@@ -86,9 +144,9 @@ class Extract:
       else:
         hops[u] = 0
       
-      for v in self.g.neighbors(u):
-        if self.label is not None and not self.label in Condition.get_edge_labels(self.g, u, v).values():
-          continue
+      explored.append(u)
+      neighbors = self.g.neighbors(u) if self.label is None else self.adjacency.neighbors(self.label, u)
+      for v in neighbors:
         if not v in finished:
           V.add(v)
         rw = self.getRWR(i, v)
@@ -97,35 +155,36 @@ class Extract:
         if (not v in dist) or (dist[v] < d):
           dist[v] = d
           hops[v] = lu + 1
-          self.pre[i][v] = u
+          pre[v] = u
+          V.update(v)
+    self.pre.set_row(i, pre)
+    self.explored[i] = explored
+    for u in explored:
+      self.expanded.setdefault(u, set()).add(i)
   
   ## Extract the best path i -> j
   def getPath(self, i, j):
-    lst = list()
-    if not i in self.pre:
-      return lst
-    if not j in self.pre[i]:
-      return lst
-    v = j
-    while v != i:
-      lst.append(v)
-      if not v in self.pre[i]:
-        return []
-      v = self.pre[i][v]
-    lst.reverse()
-    # print i, j, lst
-    return lst
+    return self.pre.get_path(i, j)
 
   ## Extract the best paths from i
-  def getPaths(self, i):
-    paths = {}
-    if not i in self.pre:
-      return paths
-    for j in self.g.nodes():
-      if not j in self.pre[i]:
-        continue
-      path = self.getPath(i, j)
-      if path:
-        paths[j] = path
+  def getPaths(self, i, ordered=False, top_k=None):
+    """
+    :param ordered: Order the paths by goodness (best first) instead of by node order
+    :param top_k: Return only the top-k paths by goodness
+    """
+    paths = self.pre.get_paths(i)
+    if ordered or top_k is not None:
+      goodness = self.getGoodness(i, paths)
+      ranked = sorted(paths, key=lambda j: -goodness[j])[:top_k]  # Stable: ties in the node order
+      paths = dict((j, paths[j]) for j in ranked)
     return paths
 
+  ## Goodness of the best paths from i (the distance of EXTRACT: the mean RWR score from i over each path)
+  def getGoodness(self, i, paths):
+    d = {i: self.getRWR(i, i)}
+    for j in sorted(paths, key=lambda j: len(paths[j])):  # Prefixes first
+      path = paths[j]
+      u = path[-2] if len(path) > 1 else i
+      lu = len(path)  # Vertices on the path i -> u
+      d[j] = (self.getRWR(i, j) + d[u] * lu)/(lu + 1)
+    return d
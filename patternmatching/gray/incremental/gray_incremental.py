@@ -10,9 +10,10 @@ import networkx as nx
 import numpy as np
 import statistics
 
-from patternmatching.gray import extract
+from patternmatching.gray import rwr
 from patternmatching.gray.incremental.extract_incremental import Extract
 from patternmatching.gray.gray_multiple import GRayMultiple
+from patternmatching.gray.match_state import MatchState
 from patternmatching.query.Condition import *
 from patternmatching.query import QueryResult
 
@@ -98,8 +99,18 @@ def compute_community_size(g):
 
 class GRayIncremental(GRayMultiple, object):
   
-  def __init__(self, orig_graph, graph, query, directed, cond, time_limit):
-    super(GRayIncremental, self).__init__(graph, query, directed, cond, time_limit)
+  def __init__(self, orig_graph, graph, query, directed, cond, time_limit, rwr_method=rwr.METHOD_BATCH,
+               rwr_dynamic=False, rwr_lazy=False, rwr_cache_rows=None, rwr_processes=1,
+               rwr_precision=rwr.PRECISION_DOUBLE, ext_lazy=False, ext_cache_rows=None, path_top_k=None,
+               ext_processes=1):
+    """
+    :param rwr_dynamic: Correct existing RWR rows after edge insertions instead of recomputing them
+    :param ext_lazy: Compute EXTRACT paths of labeled edges on demand (paths of all edges are updated incrementally)
+    """
+    super(GRayIncremental, self).__init__(graph, query, directed, cond, time_limit, rwr_method, rwr_lazy,
+                                          rwr_cache_rows, rwr_processes, rwr_precision, ext_lazy, ext_cache_rows,
+                                          path_top_k, ext_processes)
+    self.rwr_dynamic = rwr_dynamic
     self.elapsed = 0.0  # Elapsed time
     self.nodes = list()  # Added nodes (must be sorted by added timestamp)
     self.orig_graph = orig_graph
@@ -109,6 +120,7 @@ class GRayIncremental(GRayMultiple, object):
   def update_graph(self, nodes, edges):
     self.graph.add_nodes_from(nodes)
     self.graph.add_edges_from(edges)
+    self.label_adjacency.invalidate()
   
   
   def run_gray(self):
@@ -124,7 +136,7 @@ class GRayIncremental(GRayMultiple, object):
     logging.info("#### Compute RWR: %f [s]" % (ed - st))
 
     st = time.time()
-    ext = Extract(self.graph, self.graph_rwr)
+    ext = Extract(self.graph, self.graph_rwr, processes=self.ext_processes)
     ext.computeExtract_batch()
     self.extracts[''] = ext
     ed = time.time()
@@ -164,23 +176,13 @@ class GRayIncremental(GRayMultiple, object):
     for i in nodeset:
       logging.debug("#### Choose Seed: " + str(i))
       self.current_seed = i
-      result = nx.MultiDiGraph() if self.directed else nx.MultiGraph()
-      touched = []
-      nodemap = {}  ## Query Vertex -> Graph Vertex
-      unprocessed = self.query.copy()
-    
       il = Condition.get_node_label(self.graph, i)
       props = Condition.get_node_props(self.graph, i)
-      nodemap[k] = i
-      result.add_node(i)
-      result.node[i][LABEL] = il
-      for name, value in props.items():
-        result.node[i][name] = value
-    
-      touched.append(k)
+      attrs = {LABEL: il}  ## Attributes of the seed in the result
+      attrs.update(props)
       
       tmp = self.num_exact
-      self.process_neighbors(result, touched, nodemap, unprocessed)
+      self.process_match(MatchState.start(self.query_edges, k, i, attrs))
       buf += "*" if (tmp < self.num_exact) else "."  # Found new patterns?
       ts = time.time()
       if 0.0 < self.time_limit < ts - st:
@@ -224,6 +226,7 @@ class GRayIncremental(GRayMultiple, object):
   
   def add_edges(self, add_edges):
     self.graph.add_edges_from(add_edges)
+    self.label_adjacency.invalidate()
     
     
 
@@ -240,8 +243,10 @@ class GRayIncremental(GRayMultiple, object):
       nodes = affected_nodes
     # self.graph.add_nodes_from(nodes)
     subg = nx.subgraph(self.orig_graph, nodes)
+    old_weights = self.graph_rwr.weight_snapshot(add_edges) if self.rwr_dynamic else None  # Before insertion
     self.graph.add_nodes_from(subg.nodes(data=True))
     self.graph.add_edges_from(add_edges)
+    self.label_adjacency.invalidate()
     
     logging.info("Number of vertices: %d" % self.graph.number_of_nodes())
     logging.info("Number of edges: %d" % self.graph.number_of_edges())
@@ -250,16 +255,16 @@ class GRayIncremental(GRayMultiple, object):
     logging.info("Number of re-computation nodes: %d" % len(nodes))
     
     start = st = time.time()
-    self.compute_part_RWR(nodes, add_edges)
+    rescored = self.compute_part_RWR(nodes, add_edges, old_weights)
     ed = time.time()
     logging.info("#### Compute RWR: %f [s]" % (ed - st))
     
     st = time.time()
     ext = self.extracts['']  # Extract(self.graph, self.graph_rwr)
-    ext.computeExtract_incremental(nodes)
+    recomp = ext.computeExtract_incremental(set(nodes) | rescored, add_edges)  # Paths on changed RWR rows too
     self.extracts[''] = ext
     ed = time.time()
-    logging.info("#### Compute Paths: %f [s]" % (ed - st))
+    logging.info("#### Compute Paths: %f [s] (%d sources)" % (ed - st, len(recomp)))
 
     # pr = cProfile.Profile()
     # pr.enable()
@@ -272,13 +277,6 @@ class GRayIncremental(GRayMultiple, object):
 
 
   
-  def getExtract(self, label):
-    if not label in self.extracts:
-      ext = extract.Extract(self.graph, self.graph_rwr, label)
-      ext.computeExtract()
-      self.extracts[label] = ext
-    return self.extracts[label]
-
   def append_results(self, result, nodemap):
     if self.cond is not None and not self.cond.eval(result, nodemap):
       return False  ## Not satisfied with complex condition
@@ -316,166 +314,36 @@ class GRayIncremental(GRayMultiple, object):
   
 
   
-  def process_neighbors(self, result, touched, nodemap, unproc):
-    if unproc.number_of_edges() == 0:
-      if valid_result(result, self.query, nodemap):
-        logging.debug("###### Found pattern " + str(self.num_exact))
-        if self.append_results(result, nodemap):
-          self.num_exact += 1
-        return
-      else:
-        logging.debug("Approximate Pattern " + str(self.num_approx))
-        if self.append_approx(result, nodemap):
-          self.num_approx += 1
-        return
-    if result.number_of_edges() > self.query.number_of_edges():
-      logging.debug("Too many edges. Exit G-Ray algorithm.")
-      return
-    
-    k = None
-    l = None
-    kl = None
-    reversed_edge = False
-    for k_ in touched:
-      kl = Condition.get_node_label(self.query, k_)
-      # kp = Condition.get_node_props(self.query, k_)
-      
-      ## Forward Edge
-      for l_ in self.query.neighbors(k_):
-        if not unproc.has_edge(k_, l_):
-          continue
-        l = l_
-        break
-      if l is not None:
-        k = k_
-        # logging.debug("#### Process neighbors " + str(k) + " -> " + str(l))
-        break
-      
-      ## Reversed Edge
-      if self.directed:
-        for l_ in self.query.predecessors(k_):
-          if not unproc.has_edge(l_, k_):
-            continue
-          l = l_
-          break
-        if l is not None:
-          reversed_edge = True
-          k = k_
-          # logging.debug("#### Process neighbors " + str(k) + " <- " + str(l))
-          break
-          
-    
-    if l is None:
-      logging.debug("No more vertices with the same label available. Exit G-Ray algorithm.")
-      return
-    
-    logging.debug("#### Start Processing Neighbors from " + str(k) + " count " + str(self.num_exact))
-    logging.debug("## result: " + " ".join([str(e) for e in result.edges()]))
-    logging.debug("## touchd: " + " ".join([str(n) for n in touched]))
-    logging.debug("## nodemp: " + str(nodemap))
-    logging.debug("## unproc: " + " ".join([str(e) for e in unproc.edges()]))
-    
-    i = nodemap[k]
-    touched.append(l)
-    ll = Condition.get_node_label(self.query, l)
-    # lp = Condition.get_node_props(self.query, l)
-    logging.debug("## Find the next vertex " + str(k) + "[" + kl + "] -> " + str(l) + "[" + ll + "]")
-    
-    is_path = False
-    if not reversed_edge and Condition.is_path(self.query, k, l) or reversed_edge and Condition.is_path(self.query, l, k):
-      is_path = True
-    
-    #### Find a path or edge (Begin)
-    src, dst = (l, k) if reversed_edge else (k, l)
-    elabel = Condition.get_edge_label(unproc, src, dst)
-    if elabel is None:  # Accepts any labels
-      eid = None
-      el = ''
-    else:
-      eid = elabel[0]
-      el = elabel[1]
-    Condition.remove_edge_from_id(unproc, src, dst, eid)
-    
-    
-    if is_path:
-      paths = self.getExtract(el).getPaths(i)
-      if not paths:
-        logging.debug("No more paths available. Exit G-Ray algorithm.")
-        return
-      for j, path in paths.items():
-        result_ = nx.MultiDiGraph(result) if self.directed else nx.MultiGraph(result)
-        touched_ = list(touched)
-        nodemap_ = dict(nodemap)
-        unproc_ = nx.MultiDiGraph(unproc) if self.directed else nx.MultiGraph(unproc)
-    
-        if l in nodemap_ and nodemap_[l] != j:
-          prevj = nodemap_[l]
-          result_.remove_node(prevj)
-    
-        nodemap_[l] = j
-        props = Condition.get_node_props(self.graph, j)
-        result_.add_node(j)
-        for key, value in props.items():
-          result_.node[j][key] = value
-        
-        prev = i
-        for n in path:
-          result_.add_edge(prev, n)
-          prev = n
-        self.process_neighbors(result_, touched_, nodemap_, unproc_)
-    
-    else:
-      if l in nodemap:
-        jlist = [nodemap[l]]
-      else:
-        jlist = self.neighbor_expander(i, k, l, result, reversed_edge)  # find j(l) from i(k)
-        if not jlist:  ## No more neighbor candidates
-          logging.debug("No more neighbor vertices available. Exit G-Ray algorithm.")
-          return
-      
-      for j in jlist:
-        g_src, g_dst = (j, i) if reversed_edge else (i, j)
-        if g_src == g_dst:  ## No bridge process necessary
-          continue
-        path = self.bridge(g_src, g_dst)
-        # if len(path) != 1:
-        if not path:
-          logging.debug("## No path found: " + str(g_src) + " -> " + str(g_dst))
-          continue
-        logging.debug("## Find path from " + str(g_src) + " -> " + str(g_dst) + ": " + " ".join(str(n) for n in path))
-        
-        result_ = nx.MultiDiGraph(result) if self.directed else nx.MultiGraph(result)
-        touched_ = list(touched)
-        nodemap_ = dict(nodemap)
-        unproc_ = nx.MultiDiGraph(unproc) if self.directed else nx.MultiGraph(unproc)
-    
-        if l in nodemap_ and nodemap_[l] != j:  ## Need to replace mapping
-          prevj = nodemap_[l]
-          result_.remove_node(prevj)
-        nodemap_[l] = j
-        props = Condition.get_node_props(self.graph, j)
-        result_.add_node(j)
-        for k, v in props.items():
-          result_.node[j][k] = v
-        
-        prev = g_src
-        valid = True
-        for n in path:
-          if not Condition.has_edge_label(self.graph, prev, n, el):
-            valid = False
-            break
-          result_.add_edge(prev, n)
-          prev = n
-        if valid:
-          self.process_neighbors(result_, touched_, nodemap_, unproc_)
-    #### Find a path or edge (End)
+  def found_invalid(self, state, result, nodemap):
+    """Register the match as approximate
+    """
+    logging.debug("Approximate Pattern " + str(self.num_approx))
+    if self.append_approx(state.to_graph(self.graph) if result is None else result, nodemap):
+      self.num_approx += 1
     
-  def compute_part_RWR(self, nodes, edges):
+  def compute_part_RWR(self, nodes, edges, old_weights=None):
     """Compute incremental RWR
+    
+    :param old_weights: RWR_WCC.weight_snapshot of the edges taken before they were added to the graph
+    :return: Set of sources whose RWR rows were computed or corrected
     """
     recomp_nodes = added_nodes_priority(self.nodes, nodes)
-    self.graph_rwr.add_edges(edges)
-    self.graph_rwr.rwr_set(recomp_nodes)
+    in_graph = self.graph_rwr.g is self.graph  # Edges have already been added by run_incremental_gray
+    if self.rwr_dynamic:
+      rescored = self.graph_rwr.add_edges_dynamic(edges, in_graph, old_weights)
+      stats = self.graph_rwr.last_update
+      new_nodes = [n for n in recomp_nodes if not self.graph_rwr.has_source(n)]
+      self.graph_rwr.rwr_set(new_nodes)
+      rescored.update(new_nodes)
+      logging.info("RWR rows updated: %d, reused: %d, computed: %d" % (stats["updated"], stats["reused"], len(new_nodes)))
+    else:
+      self.graph_rwr.add_edges(edges, in_graph)
+      self.graph_rwr.rwr_set(recomp_nodes)
+      rescored = set(recomp_nodes)
+    changed = self.graph_rwr.last_changed
+    merged = sum(1 for former in changed.values() if len(former) > 1)
+    logging.info("Touched components: %d, merged: %d" % (len(changed), merged))
+    return rescored
   
   
   def separate_exist_nodes(self, affected_nodes):
@@ -0,0 +1,66 @@
+"""
+Adjacency of the graph filtered by edge label
+
+For each edge label, the neighbors reachable over an edge with the label are kept in CSR form
+(offsets over one node order of the graph and a flat list of neighbor IDs), built in a single pass over
+the edges. Neighbors are kept as node IDs rather than indices, so a lookup is one list slice.
+One index is shared by all label-specific Extract instances, so they do not look up the labels
+of every edge (Condition.get_edge_labels) while searching paths.
+"""
+
+from patternmatching.query.Condition import LABEL
+from patternmatching.gray.rwr_store import NodeIndex
+
+
+class LabelAdjacency:
+  """Neighbors over edges of each label (label --> CSR of node --> neighbors)
+  """
+
+  def __init__(self, g):
+    """
+    :param g: Input graph (the index is built on first use, and rebuilt after invalidate)
+    """
+    self.g = g
+    self.node_index = None
+    self.csr = None  # Label --> (indptr, neighbor IDs)
+
+  def invalidate(self):
+    """Drop the index after the graph is modified
+    """
+    self.node_index = None
+    self.csr = None
+
+  def _build(self):
+    node_index = NodeIndex(self.g.nodes())
+    multi = self.g.is_multigraph()
+    csr = dict()  # Label --> (indptr, neighbor IDs) in the order of g.neighbors
+    for iu, (u, nbrs) in enumerate(self.g.adjacency()):
+      for v, data in nbrs.items():
+        edges = data.values() if multi else (data,)
+        for label in set(d.get(LABEL) for d in edges):
+          if label not in csr:
+            csr[label] = ([0], list())
+          indptr, dst = csr[label]
+          indptr.extend([len(dst)] * (iu + 1 - len(indptr)))  # Close the rows up to u
+          dst.append(v)
+    n = len(node_index)
+    for indptr, dst in csr.values():
+      indptr.extend([len(dst)] * (n + 1 - len(indptr)))
+    self.node_index = node_index
+    self.csr = csr
+
+  def neighbors(self, label, u):
+    """Neighbors of u over edges with the label (in the order of g.neighbors)
+    """
+    if self.csr is None:
+      self._build()
+    if label not in self.csr or u not in self.node_index:
+      return list()
+    indptr, dst = self.csr[label]
+    i = self.node_index.index[u]
+    return dst[indptr[i]:indptr[i + 1]]
+
+  def labels(self):
+    if self.csr is None:
+      self._build()
+    return list(self.csr.keys())
@@ -0,0 +1,225 @@
+"""
+Partial-match state of the G-Ray search
+
+The search used to copy the partial result graph, the unprocessed query graph, the touched list and the
+node map for every candidate branch. A MatchState keeps them as small tuples (mapped vertices, touched
+query vertices, result vertices and result edges) and a bitmask of processed query edges, and a NetworkX
+graph is built only for complete matches (to_graph).
+
+Query edges are numbered in the adjacency order of a copied query graph, which is the order the search
+used to see in its copies of the unprocessed query, so the edge chosen for a vertex pair is the same.
+"""
+
+import networkx as nx
+
+from patternmatching.query.Condition import LABEL, Condition
+
+NODE_INITIAL = 1  # Vertex with the attributes given at the start (e.g. the seed)
+NODE_PROPS = 2  # Vertex mapped to a query vertex (with the properties of the input graph)
+
+
+class QueryEdges:
+  """Numbered edges of the query (edge ID --> bit of MatchState.done)
+  """
+
+  def __init__(self, query):
+    self.query = query
+    self.directed = query.is_directed()
+    canon = nx.MultiDiGraph(query.copy()) if self.directed else nx.MultiGraph(query.copy())
+    self.edges = list()  # Edge ID --> (src, dst, key, data)
+    self.pairs = dict()  # (src, dst) --> list of (key, edge ID) in key order
+    self.incident = dict()  # Vertex --> edge IDs of edges from the vertex in adjacency order
+    ids = dict()  # (src, dst, key) --> edge ID
+    adj = canon.succ if self.directed else canon.adj
+    for u, nbrs in adj.items():
+      for v, keydict in nbrs.items():
+        for key, data in keydict.items():
+          if (u, v, key) not in ids:
+            ids[(u, v, key)] = len(self.edges)
+            if not self.directed:
+              ids[(v, u, key)] = len(self.edges)
+            self.edges.append((u, v, key, data))
+            self.pairs.setdefault((u, v), list()).append((key, ids[(u, v, key)]))
+            if not self.directed and u != v:
+              self.pairs[(v, u)] = self.pairs[(u, v)]
+          self.incident.setdefault(u, list()).append(ids[(u, v, key)])
+    self.full = (1 << len(self.edges)) - 1
+
+  def has_edge(self, done, src, dst):
+    return any(not done >> e & 1 for _, e in self.pairs.get((src, dst), ()))
+
+  def edge_label(self, done, src, dst):
+    """Same as Condition.get_edge_label on the unprocessed query
+    """
+    for e in self.incident.get(src, ()):
+      if done >> e & 1:
+        continue
+      _, _, key, data = self.edges[e]
+      v = data.get(dst)
+      if v is not None and LABEL in v:
+        return key, v[LABEL]
+    return None
+
+  def remove_edge(self, done, src, dst, eid):
+    """Same as Condition.remove_edge_from_id on the unprocessed query
+
+    :return: Bitmask of processed edges with the removed edge
+    """
+    if eid is None:
+      for e in self.incident.get(src, ()):
+        if not done >> e & 1:
+          eid = self.edges[e][2]  # Pick up the first ID
+          break
+    candidates = [(key, e) for key, e in self.pairs.get((src, dst), ()) if not done >> e & 1]
+    if eid is None and candidates:
+      return done | 1 << candidates[-1][1]
+    for key, e in candidates:
+      if key == eid:
+        return done | 1 << e
+    raise nx.NetworkXError("The edge %s-%s with key %s is not in the graph." % (src, dst, eid))
+
+  def unprocessed(self, done):
+    return [(u, v) for e, (u, v, _, _) in enumerate(self.edges) if not done >> e & 1]
+
+
+class MatchState:
+  """Partial match of the query (never modified: advance and extend return new states)
+  """
+
+  __slots__ = ("query_edges", "mapped", "touched", "nodes", "flags", "edges", "done", "attrs")
+
+  def __init__(self, query_edges, mapped, touched, nodes, flags, edges, done, attrs):
+    """
+    :type query_edges: QueryEdges
+    :param mapped: Tuple of (query vertex, graph vertex) in mapping order
+    :param touched: Tuple of touched query vertices
+    :param nodes: Tuple of result vertices in insertion order
+    :param flags: Tuple of NODE_* flags of the result vertices
+    :param edges: Tuple of result edges (src, dst) in insertion order
+    :param done: Bitmask of processed query edges
+    :param attrs: Dict of vertex --> attributes of NODE_INITIAL vertices
+    """
+    self.query_edges = query_edges
+    self.mapped = mapped
+    self.touched = touched
+    self.nodes = nodes
+    self.flags = flags
+    self.edges = edges
+    self.done = done
+    self.attrs = attrs
+
+  @staticmethod
+  def start(query_edges, k, i, attrs):
+    """State with query vertex k mapped to the seed i
+
+    :param attrs: Attributes of i in the result
+    """
+    return MatchState(query_edges, ((k, i),), (k,), (i,), (NODE_INITIAL,), (), 0, {i: attrs})
+
+  @staticmethod
+  def from_graphs(query_edges, result, touched, nodemap, unproc):
+    """State of a partial match given as graphs (result graph and unprocessed query)
+    """
+    done = 0
+    for e, (u, v, key, _) in enumerate(query_edges.edges):
+      if not unproc.has_edge(u, v, key):
+        done |= 1 << e
+    nodes = tuple(result.nodes())
+    return MatchState(query_edges, tuple(nodemap.items()), tuple(touched), nodes, (NODE_INITIAL,) * len(nodes),
+                      tuple(result.edges()), done, dict((n, dict(result.nodes[n])) for n in nodes))
+
+  def complete(self):
+    return self.done == self.query_edges.full
+
+  def get(self, k):
+    """Graph vertex mapped to query vertex k (None if not mapped)
+    """
+    for k_, i in self.mapped:
+      if k_ == k:
+        return i
+    return None
+
+  def nodemap(self):
+    return dict(self.mapped)
+
+  def has_node(self, n):
+    return n in self.nodes
+
+  def number_of_nodes(self):
+    return len(self.nodes)
+
+  def number_of_edges(self):
+    return len(self.edges)
+
+  def degree(self, n):
+    return sum((u == n) + (v == n) for u, v in self.edges)
+
+  def has_query_edge(self, src, dst):
+    """Whether an unprocessed query edge src - dst exists
+    """
+    return self.query_edges.has_edge(self.done, src, dst)
+
+  def edge_label(self, src, dst):
+    return self.query_edges.edge_label(self.done, src, dst)
+
+  def unprocessed(self):
+    return self.query_edges.unprocessed(self.done)
+
+  def advance(self, l, src, dst, eid):
+    """State after touching l and processing the query edge src - dst with ID eid
+    """
+    return MatchState(self.query_edges, self.mapped, self.touched + (l,), self.nodes, self.flags, self.edges,
+                      self.query_edges.remove_edge(self.done, src, dst, eid), self.attrs)
+
+  def extend(self, l, j, start, path):
+    """State after mapping l to j (the previous vertex of l is removed) and adding the path start -> path
+
+    :param path: Vertices of the path without start
+    """
+    nodes = list(self.nodes)
+    flags = list(self.flags)
+    edges = self.edges
+    mapped = list(self.mapped)
+    prevj = self.get(l)
+    if prevj is not None and prevj != j:  ## Need to replace mapping
+      if prevj not in nodes:
+        raise nx.NetworkXError("The node %s is not in the graph." % (prevj,))
+      pos = nodes.index(prevj)
+      del nodes[pos]
+      del flags[pos]
+      edges = tuple(e for e in edges if e[0] != prevj and e[1] != prevj)
+    if prevj is None:
+      mapped.append((l, j))
+    else:
+      mapped = [(k, j if k == l else i) for k, i in mapped]
+    if j in nodes:
+      flags[nodes.index(j)] |= NODE_PROPS
+    else:
+      nodes.append(j)
+      flags.append(NODE_PROPS)
+    new_edges = list()
+    prev = start
+    for n in path:
+      for v in (prev, n):
+        if v not in nodes:
+          nodes.append(v)
+          flags.append(0)
+      new_edges.append((prev, n))
+      prev = n
+    return MatchState(self.query_edges, tuple(mapped), self.touched, tuple(nodes), tuple(flags),
+                      edges + tuple(new_edges), self.done, self.attrs)
+
+  def to_graph(self, graph):
+    """Result graph of the match
+
+    :param graph: Input graph (properties of the mapped vertices)
+    """
+    result = nx.MultiDiGraph() if self.query_edges.directed else nx.MultiGraph()
+    for n, flag in zip(self.nodes, self.flags):
+      result.add_node(n)
+      if flag & NODE_INITIAL:
+        result.nodes[n].update(self.attrs[n])
+      if flag & NODE_PROPS:
+        result.nodes[n].update(Condition.get_node_props(graph, n))
+    result.add_edges_from(self.edges)
+    return result
@@ -10,13 +10,14 @@ sys.path.append(".")
 
 from patternmatching.query.ConditionParser import ConditionParser
 from patternmatching.gray.gray_multiple import GRayMultiple
+from patternmatching.gray import rwr
 from patternmatching.query.Condition import *
 
 
 class GRayParallel(GRayMultiple, object):
   
   def __init__(self, graph, query, directed, cond, time_limit, seeds=None):
-    super(GRayParallel, self).__init__(graph, query, directed, cond, time_limit)
+    super(GRayParallel, self).__init__(graph, query, directed, cond, time_limit, rwr.METHOD_PUSH)  # RWR from seeds only
     self.seeds = seeds
     self.called = 0
   
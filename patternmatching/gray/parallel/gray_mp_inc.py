@@ -12,13 +12,14 @@ sys.path.append(".")
 from patternmatching.gray.incremental.query_call import get_seeds
 from patternmatching.query.ConditionParser import ConditionParser
 from patternmatching.gray.incremental.gray_incremental import GRayIncremental
+from patternmatching.gray import rwr
 from patternmatching.query.Condition import *
 
 
 class GRayParallelInc(GRayIncremental, object):
   
   def __init__(self, orig_graph, graph, query, directed, cond, time_limit, pid, edges):
-    super(GRayParallelInc, self).__init__(orig_graph, graph, query, directed, cond, time_limit)
+    super(GRayParallelInc, self).__init__(orig_graph, graph, query, directed, cond, time_limit, rwr.METHOD_PUSH)
     seeds = set([src for (src, dst, _) in edges] + [dst for (src, dst, _) in edges])  # Affected nodes
     self.seeds = seeds
     self.called = 0
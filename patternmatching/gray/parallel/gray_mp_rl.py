@@ -12,6 +12,7 @@ from multiprocessing import Process  # Use Process instead of Pool
 sys.path.append(".")
 
 from patternmatching.gray.rwr import RWR_WCC
+from patternmatching.gray import rwr_mmap
 from patternmatching.query.ConditionParser import ConditionParser
 from patternmatching.gray.incremental.gray_incremental import GRayIncremental
 from patternmatching.query.Condition import *
@@ -26,9 +27,12 @@ class GRayParallelInc(GRayIncremental, object):
     self.called = 0
     self.nodes = list(graph.nodes())
     
-    self.rwr_pickle = str(pid) + "_rwr.pickle"
+    self.rwr_store = str(pid) + "_rwr"
+    self.rwr_pickle = str(pid) + "_rwr.pickle"  # Old format
     self.ext_pickle = str(pid) + "_ext.pickle"
-    if os.path.isfile(self.rwr_pickle):
+    if rwr_mmap.is_store(self.rwr_store):
+      self.graph_rwr = RWR_WCC.load(self.rwr_store)
+    elif os.path.isfile(self.rwr_pickle):
       self.graph_rwr = RWR_WCC.load_pickle(self.rwr_pickle)
     if os.path.isfile(self.ext_pickle):
       with open(self.ext_pickle, "rb") as rf:
@@ -76,7 +80,7 @@ class GRayParallelInc(GRayIncremental, object):
         print("Timeout G-Ray iterations")
         break
     
-    self.graph_rwr.dump_pickle(self.rwr_pickle)
+    self.graph_rwr.save(self.rwr_store)
     with open(self.ext_pickle, "wb") as wf:
       pickle.dump(self.extracts[''], wf)
   
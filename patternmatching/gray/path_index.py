@@ -0,0 +1,156 @@
+"""
+Compact predecessor index of EXTRACT paths
+
+The best paths from a source form a tree of predecessors. Instead of a dict of dicts
+(source --> vertex --> predecessor), each source keeps one int32 array: the sorted indices of the reached
+vertices followed by the indices of their predecessors. Vertex indices follow the node order of the graph,
+so paths are listed in the same order as g.nodes().
+"""
+
+import bisect
+from collections.abc import Mapping
+
+import numpy as np
+
+INDEX_DTYPE = np.int32
+
+
+class PathIndex(Mapping):
+  """Predecessor trees of all sources (read as a mapping of source --> dict of vertex --> predecessor)
+  """
+
+  def __init__(self, g):
+    """
+    :param g: Input graph (node order of the index; nodes added to g later are appended)
+    """
+    self.g = g
+    self.nodes = list()
+    self.index = dict()  # Node ID --> index
+    self.rows = dict()  # Source --> int32 array of [sorted vertex indices, predecessor indices]
+    self._sync()
+
+  def _sync(self):
+    if len(self.nodes) < self.g.number_of_nodes():
+      for n in self.g.nodes():
+        if n not in self.index:
+          self.index[n] = len(self.nodes)
+          self.nodes.append(n)
+
+  def _index_of(self, n):
+    if n not in self.index:
+      self._sync()
+      if n not in self.index:  # Not in the graph
+        self.index[n] = len(self.nodes)
+        self.nodes.append(n)
+    return self.index[n]
+
+  def __getitem__(self, src):
+    targets, preds = self._split(self.rows[src])
+    nodes = self.nodes
+    return dict((nodes[t], nodes[p]) for t, p in zip(targets.tolist(), preds.tolist()))
+
+  def __iter__(self):
+    return iter(self.rows)
+
+  def __len__(self):
+    return len(self.rows)
+
+  def __contains__(self, src):
+    return src in self.rows
+
+  @staticmethod
+  def _split(row):
+    k = len(row) // 2
+    return row[:k], row[k:]
+
+  def set_row(self, src, pre):
+    """Store the predecessors of the best paths from src
+
+    :param pre: Dict of vertex --> predecessor (pre[src] = src)
+    """
+    k = len(pre)
+    row = np.empty(2 * k, dtype=INDEX_DTYPE)
+    row[:k] = [self._index_of(v) for v in pre]
+    row[k:] = [self._index_of(u) for u in pre.values()]
+    order = np.argsort(row[:k], kind='stable')
+    row[:k] = row[:k][order]
+    row[k:] = row[k:][order]
+    self.rows[src] = row
+
+  def set_row_indices(self, src, targets, preds):
+    """Store the predecessors of the best paths from src given as indices in node_list()
+
+    :param targets: Sorted indices of the reached vertices (including src)
+    :param preds: Indices of the predecessors of the targets
+    """
+    self.rows[src] = np.concatenate((targets, preds)).astype(INDEX_DTYPE)
+
+  def set_rows(self, nodes, rows):
+    """Replace the index with rows over another node list (e.g. loaded by path_mmap.load_index)
+
+    :param nodes: Node list of the vertex indices in the rows
+    :param rows: Dict of source --> row
+    """
+    self.nodes = list(nodes)
+    self.index = dict((n, idx) for idx, n in enumerate(self.nodes))
+    self.rows = dict(rows)
+    self._sync()
+
+  def node_list(self):
+    """Nodes in index order (including the nodes added to the graph so far)
+    """
+    self._sync()
+    return self.nodes
+
+  def remove(self, src):
+    self.rows.pop(src, None)
+
+  def get_path(self, src, dst):
+    """Best path src -> dst without src (empty if dst is not reached)
+    """
+    row = self.rows.get(src)
+    if row is None or dst not in self.index:
+      return list()
+    targets, preds = self._split(row)
+    k = len(targets)
+    s = self.index[src]
+    v = self.index[dst]
+    lst = list()
+    while v != s:
+      pos = bisect.bisect_left(targets, v)
+      if pos == k or targets[pos] != v or len(lst) > k:
+        return list()
+      lst.append(self.nodes[v])
+      v = int(preds[pos])
+    lst.reverse()
+    return lst
+
+  def get_paths(self, src):
+    """Best paths from src to every reached vertex
+
+    :return: Dict of destination --> path (in the node order of the graph)
+    """
+    row = self.rows.get(src)
+    if row is None:
+      return dict()
+    targets, preds = self._split(row)
+    targets = targets.tolist()
+    parent = dict(zip(targets, preds.tolist()))
+    s = self.index[src]
+    nodes = self.nodes
+    paths = dict()
+    for t in targets:
+      if t == s:
+        continue
+      path = list()
+      v = t
+      while v != s and v >= 0 and len(path) <= len(targets):  # Bounded in case of a broken tree
+        path.append(nodes[v])
+        v = parent.get(v, -1)
+      if v == s:
+        path.reverse()
+        paths[nodes[t]] = path
+    return paths
+
+  def nbytes(self):
+    return sum(row.nbytes for row in self.rows.values())
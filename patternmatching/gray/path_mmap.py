@@ -0,0 +1,131 @@
+"""
+Versioned on-disk format of EXTRACT path indexes that can be memory-mapped
+
+An index is saved as a directory named after its key (see key_path):
+  meta.json            Format version and key (graph fingerprint, edge label and MAX_LENGTH)
+  nodes.pickle         Node list of the PathIndex (vertex indices of the rows)
+  sources.npy          Vertex index of each source
+  indptr.npy           Offsets of the row of each source in rows.npy
+  rows.npy             Rows of PathIndex (sorted vertex indices followed by predecessor indices, int32)
+
+The rows are opened with np.load(mmap_mode='c'), so loading an index does not read the paths, and runs
+on the same graph share the pages through the OS cache.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+from patternmatching.gray.path_index import INDEX_DTYPE
+
+FORMAT_NAME = "extract-paths"
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+NODES_FILE = "nodes.pickle"
+
+SCORE_PARAMS = ("restart_prob", "og_prob", "method", "push_tol", "top_k", "epsilon", "max_entries", "mc_walks",
+                "precision")  # RWR parameters that change the scores (and so the paths)
+
+
+def graph_fingerprint(g, rwr_params=None):
+  """Digest of the nodes and edges of the graph (in iteration order, with attributes) and the RWR parameters
+
+  :param rwr_params: Dict of RWR parameters (RWR_WCC.params())
+  """
+  h = hashlib.sha1()
+  h.update(repr((g.is_directed(), g.is_multigraph())).encode())
+  for n in g.nodes():
+    h.update(repr(n).encode())
+  h.update(b"|")
+  edges = g.edges(keys=True, data=True) if g.is_multigraph() else g.edges(data=True)
+  for e in edges:
+    h.update(repr(e).encode())
+  if rwr_params is not None:
+    h.update(repr(sorted((name, rwr_params.get(name)) for name in SCORE_PARAMS)).encode())
+  return h.hexdigest()
+
+
+def make_key(fingerprint, label, max_length):
+  return {"fingerprint": fingerprint, "label": repr(label), "max_length": max_length}
+
+
+def key_path(directory, key):
+  """Directory of the index with the key under a cache directory
+  """
+  digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+  return os.path.join(directory, "paths_%s" % digest)
+
+
+def save_index(pre, path, key):
+  """Save the rows of a path index into a directory
+
+  :type pre: patternmatching.gray.path_index.PathIndex
+  :param path: Output directory (replaced as a whole if it exists)
+  :param key: Key dict (make_key)
+  """
+  nodes = pre.node_list()
+  sources = list(pre.rows.keys())
+  indptr = np.zeros(len(sources) + 1, dtype=np.int64)
+  indptr[1:] = np.cumsum([len(pre.rows[src]) for src in sources])
+
+  ## Write into a temporary directory first: the index being saved may be memory-mapped from the old files
+  path = path.rstrip(os.sep)
+  tmp_path = path + ".tmp"
+  if os.path.isdir(tmp_path):
+    shutil.rmtree(tmp_path)
+  os.makedirs(tmp_path)
+  np.save(os.path.join(tmp_path, "sources.npy"), np.array([pre.index[src] for src in sources], dtype=INDEX_DTYPE))
+  np.save(os.path.join(tmp_path, "indptr.npy"), indptr)
+  rows = [pre.rows[src] for src in sources]
+  np.save(os.path.join(tmp_path, "rows.npy"), np.concatenate(rows) if rows else np.zeros(0, dtype=INDEX_DTYPE))
+  with open(os.path.join(tmp_path, NODES_FILE), "wb") as wf:
+    pickle.dump(nodes, wf, protocol=pickle.HIGHEST_PROTOCOL)
+  meta = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "key": key, "sources": len(sources)}
+  with open(os.path.join(tmp_path, META_FILE), "w") as wf:
+    json.dump(meta, wf)
+
+  if os.path.isdir(path):
+    old_path = path + ".old"
+    if os.path.isdir(old_path):
+      shutil.rmtree(old_path)
+    os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path)
+  else:
+    os.rename(tmp_path, path)
+
+
+def read_meta(path):
+  """Metadata of the index in the directory (None if there is no valid index)
+  """
+  meta_file = os.path.join(path, META_FILE)
+  if not os.path.isfile(meta_file):
+    return None
+  with open(meta_file, "r") as rf:
+    meta = json.load(rf)
+  if meta.get("format") != FORMAT_NAME or meta.get("version", 0) > FORMAT_VERSION:
+    return None
+  return meta
+
+
+def load_index(path, mmap_mode="c"):
+  """Open an index saved by save_index
+
+  :param path: Index directory
+  :param mmap_mode: Memory-map mode of the rows ('c': copy-on-write, 'r': read-only, None: read into memory)
+  :return: Tuple of node list, dict of source --> row and metadata dict
+  """
+  meta = read_meta(path)
+  if meta is None:
+    raise ValueError("Not an EXTRACT path index directory: %s" % path)
+  with open(os.path.join(path, NODES_FILE), "rb") as rf:
+    nodes = pickle.load(rf)
+  sources = np.load(os.path.join(path, "sources.npy")).tolist()
+  indptr = np.load(os.path.join(path, "indptr.npy")).tolist()
+  rows = np.load(os.path.join(path, "rows.npy"), mmap_mode=mmap_mode)
+  row_map = dict((nodes[src], rows[indptr[k]:indptr[k + 1]]) for k, src in enumerate(sources))
+  return nodes, row_map, meta
@@ -191,7 +191,7 @@ def run_query_step(graph_json, query_args, base_steps=100, max_steps=10, time_li
   
 
 
-def run_query(graph_json, query_args, plot_graph=False, show_graph=False, time_limit=0.0):
+def run_query(graph_json, query_args, plot_graph=False, show_graph=False, time_limit=0.0, ext_store=None):
   
   
   """
@@ -346,7 +346,7 @@ def run_query(graph_json, query_args, plot_graph=False, show_graph=False, time_l
   else:
     pr = None
   
-  grm = GRayMultiple(graph, query, directed, cond, time_limit)
+  grm = GRayMultiple(graph, query, directed, cond, time_limit, ext_store=ext_store)
   grm.run_gray()
   results = grm.get_results()
 
@@ -7,29 +7,108 @@ Retrieved and simplified some functions from https://github.com/TuftsBCB/Walker/
 
 import numpy as np
 import networkx as nx
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
 from sklearn.preprocessing import normalize
-from collections import defaultdict
 import sys
 import pickle
+from collections import OrderedDict
+
+from patternmatching.gray.rwr_store import NodeIndex, DictScoreStore, ArrayScoreStore, SparseScoreStore, LogQuantizer
+from patternmatching.gray.rwr_push import forward_push, reverse_push, out_weights, PUSH_TOLERANCE
+from patternmatching.gray.components import WeakComponents
+from patternmatching.gray.rwr_mc import MonteCarloWalker, MC_WALKS, standard_error
+from patternmatching.gray import rwr_mmap
+from patternmatching.gray.rwr_parallel import rwr_parallel
 
 CONV_THRESHOLD = 0.001
 
+## RWR computation methods of RWR_WCC
+METHOD_POWER = "power"  # Power iteration for each source
+METHOD_BATCH = "batch"  # Power iteration for blocks of sources (sparse matrix x dense matrix)
+METHOD_PUSH = "push"  # Local forward push from each source (approximate, without component extraction)
+METHOD_SOLVE = "solve"  # Sparse LU factorization per component (exact), batch mode for large components
+METHOD_MC = "montecarlo"  # Vectorized Monte Carlo random walks for blocks of sources (approximate)
+
+## Precisions of stored scores
+PRECISION_DOUBLE = "float64"
+PRECISION_SINGLE = "float32"
+PRECISION_LOG16 = "log16"  # uint16 codes on a log scale (LogQuantizer)
+
+BATCH_BYTES = 16 * 1024 * 1024  # Memory budget of a block of sources in batch mode
+BATCH_ARRAYS = 4  # Number of dense n x b arrays alive during a batched power iteration
+SOLVE_MAX_NODES = 2000  # Largest component factorized in solve mode (fill-in of LU grows quickly)
+
+
+def truncate_scores(p, epsilon, k):
+  """Scores above epsilon, only the top-k of them if k is given
+
+  :return: Tuple of sorted local indices and their scores
+  """
+  indices = np.flatnonzero(p > (epsilon or 0.0))
+  if k is not None and indices.size > k:
+    indices = indices[np.argpartition(p[indices], -k)[-k:]]
+  indices.sort()
+  return indices, p[indices]
+
 
 class RWR_WCC:
   """RWR optimized with weakly connected component
   """
   
-  def __init__(self, g, restart_prob, og_prob):
+  def __init__(self, g, restart_prob, og_prob, store=None, method=METHOD_BATCH, batch_bytes=BATCH_BYTES,
+               top_k=None, epsilon=None, max_entries=None, push_tol=PUSH_TOLERANCE, lazy=False, cache_rows=None,
+               mc_walks=MC_WALKS, seed=None, processes=1, precision=PRECISION_DOUBLE):
+    """
+    :param store: Score store backend (SparseScoreStore if rows are truncated, pushed or sampled, ArrayScoreStore otherwise)
+    :param method: RWR computation method (METHOD_POWER, METHOD_BATCH, METHOD_PUSH, METHOD_SOLVE or METHOD_MC)
+    :param batch_bytes: Memory budget in bytes of a block of sources in batch and solve modes
+    :param top_k: Keep only the top-k destinations of each source
+    :param epsilon: Keep only the destinations with scores above epsilon
+    :param max_entries: Total number of stored scores, split evenly over the vertices
+    :param push_tol: Residual tolerance of push mode
+    :param lazy: Compute the row of a source on its first get_value or get_dsts
+    :param cache_rows: Maximum number of rows kept in lazy mode (least recently used rows are evicted, None: unbounded)
+    :param mc_walks: Number of walks per source in Monte Carlo mode
+    :param seed: Random seed of Monte Carlo mode
+    :param processes: Number of worker processes of rwr_set and rwr_all in power, batch and solve modes
+    :param precision: Precision of stored scores (PRECISION_DOUBLE, PRECISION_SINGLE or PRECISION_LOG16)
+    """
     self.g = g
     self.restart_prob = restart_prob
     self.og_prob = og_prob
-    self.wccs = list(nx.weakly_connected_components(g.to_directed()))
+    self.method = method
+    self._components = None  # WeakComponents (built on first use, push mode does not need it)
     self.num = g.number_of_nodes()
-    # self.idmap = dict()
-    # for idx, vid in enumerate(g.nodes()):
-    #   self.idmap[vid] = idx  # Vertex ID --> Index
-    # self.mat = np.zeros((num, num), dtype=float)
-    self.mat = dict()
+    self.batch_bytes = batch_bytes
+    self.top_k = top_k
+    self.epsilon = epsilon
+    self.max_entries = max_entries
+    self.push_tol = push_tol
+    self.dropped_mass = 0.0  # Total probability mass of truncated scores
+    self.dropped_entries = 0  # Total number of truncated scores
+    self.precision = precision
+    if store is None:
+      dtype = np.float32 if precision == PRECISION_SINGLE else np.float64
+      codec = LogQuantizer() if precision == PRECISION_LOG16 else None
+      if self.is_truncated() or method in (METHOD_PUSH, METHOD_MC):
+        store = SparseScoreStore(dtype, codec)
+      else:
+        store = ArrayScoreStore(dtype, codec)
+    self.store = store
+    self.operators = dict()  # Component root --> ComponentOperator
+    self.last_changed = dict()  # Components touched by the last add_edges (root --> former roots)
+    self.last_update = dict()  # Numbers of updated and reused rows by the last add_edges_dynamic
+    self.columns = dict()  # Target --> (NodeIndex, scores of the target from the sources in NodeIndex)
+    self.lazy = lazy
+    self.cache_rows = None if cache_rows is None else max(1, cache_rows)
+    self.recent = OrderedDict()  # Sources with rows in lazy mode (least recently used first)
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.mc_walks = mc_walks
+    self.rng = np.random.default_rng(seed)
+    self.processes = processes
   
   @staticmethod
   def load_pickle(fname):
@@ -38,106 +117,535 @@ class RWR_WCC:
     g = data["graph"]
     restart_prob = data["restart_prob"]
     og_prob = data["og_prob"]
-    mat = data["mat"]
+    if "store" in data:
+      store = data["store"]
+    else:  # Old format with dict of dicts
+      store = DictScoreStore()
+      for src, value_map in data["mat"].items():
+        store.set_values(src, value_map)
     
-    rwr_wcc = RWR_WCC(g, restart_prob, og_prob)
-    rwr_wcc.mat = mat
-    return rwr_wcc
+    return RWR_WCC(g, restart_prob, og_prob, store, method=data.get("method", METHOD_BATCH),
+                   top_k=data.get("top_k"), epsilon=data.get("epsilon"), max_entries=data.get("max_entries"),
+                   push_tol=data.get("push_tol", PUSH_TOLERANCE), lazy=data.get("lazy", False),
+                   cache_rows=data.get("cache_rows"), mc_walks=data.get("mc_walks", MC_WALKS),
+                   precision=data.get("precision", PRECISION_DOUBLE))
+
+  def is_truncated(self):
+    return self.top_k is not None or self.epsilon is not None or self.max_entries is not None
+
+  def truncation_stats(self):
+    """Statistics of truncated RWR rows (accumulated over all computed rows)
+    """
+    return {"dropped_mass": self.dropped_mass, "dropped_entries": self.dropped_entries,
+            "stored_entries": self.store.num_entries()}
 
   def dump_pickle(self, fname):
     data = dict()
     data["graph"] = self.g
     data["restart_prob"] = self.restart_prob
     data["og_prob"] = self.og_prob
-    data["mat"] = self.mat
+    data["store"] = self.store
+    data["method"] = self.method
+    data["push_tol"] = self.push_tol
+    data["top_k"] = self.top_k
+    data["epsilon"] = self.epsilon
+    data["max_entries"] = self.max_entries
+    data["lazy"] = self.lazy
+    data["cache_rows"] = self.cache_rows
+    data["mc_walks"] = self.mc_walks
+    data["precision"] = self.precision
     with open(fname, mode="wb") as wf:
       pickle.dump(data, wf)
+
+  def params(self):
+    return {"restart_prob": self.restart_prob, "og_prob": self.og_prob, "method": self.method,
+            "push_tol": self.push_tol, "top_k": self.top_k, "epsilon": self.epsilon, "max_entries": self.max_entries,
+            "lazy": self.lazy, "cache_rows": self.cache_rows, "mc_walks": self.mc_walks, "precision": self.precision}
+
+  def save(self, path):
+    """Save the graph and the scores in the memory-mappable store format (see rwr_mmap)
+
+    :param path: Output directory
+    """
+    rwr_mmap.save_store(self.store, path, graph=self.g, params=self.params())
+
+  @staticmethod
+  def load(path, mmap_mode="c"):
+    """Open RWR scores saved by save (score arrays are memory-mapped, not read)
+
+    :param path: Store directory
+    :param mmap_mode: Memory-map mode of the score arrays (None: read into memory)
+    :rtype: RWR_WCC
+    """
+    store, g, meta = rwr_mmap.load_store(path, mmap_mode=mmap_mode)
+    params = meta["params"]
+    return RWR_WCC(g, params["restart_prob"], params["og_prob"], store, method=params.get("method", METHOD_BATCH),
+                   top_k=params.get("top_k"), epsilon=params.get("epsilon"), max_entries=params.get("max_entries"),
+                   push_tol=params.get("push_tol", PUSH_TOLERANCE), lazy=params.get("lazy", False),
+                   cache_rows=params.get("cache_rows"), mc_walks=params.get("mc_walks", MC_WALKS),
+                   precision=params.get("precision", PRECISION_DOUBLE))
+  
+  @property
+  def components(self):
+    """
+    :rtype: WeakComponents
+    """
+    if self._components is None:
+      self._components = WeakComponents(self.g)
+    return self._components
+  
+  @property
+  def wccs(self):
+    return list(self.components)
   
-  def add_edges(self, edges):
-    self.g.add_edges_from(edges)
-    self.wccs = list()
-    for wcc in nx.connected_components(self.g):
-      self.wccs.append(wcc)
+  def add_edges(self, edges, in_graph=False):
+    """Add edges and update components incrementally
+    
+    :param in_graph: Whether the edges have already been added to the graph by the caller
+    :return: Dict of component root --> set of former roots merged into it, for every touched component
+    """
+    edges = list(edges)
+    if not in_graph:
+      self.g.add_edges_from(edges)
     self.num = self.g.number_of_nodes()
+    if self._components is None:
+      self.columns = dict()
+      self.last_changed = dict()
+      return self.last_changed
+    changed = self.components.add_edges(edges)
+    self._drop_columns(changed)
+    for root, former in changed.items():
+      if len(former) == 1 and root in self.operators:  # Same members, new edges
+        self.operators[root].reset()
+        continue
+      for r in former:
+        self.operators.pop(r, None)
+    self.last_changed = changed
+    return changed
+  
+  def _added_weights(self, edges):
+    """Added weights of the edges (tail --> head --> weight, both directions in undirected graphs)
+    """
+    added = dict()
+    for e in edges:
+      data = e[-1] if len(e) > 2 and isinstance(e[-1], dict) else {}
+      arcs = [(e[0], e[1])] if self.g.is_directed() or e[0] == e[1] else [(e[0], e[1]), (e[1], e[0])]
+      for u, v in arcs:
+        heads = added.setdefault(u, dict())
+        heads[v] = heads.get(v, 0) + data.get("weight", 1)
+    return added
+  
+  def weight_snapshot(self, edges):
+    """Out-weights of the tails of the edges before they are added (old_weights of add_edges_dynamic)
+    
+    :return: Dict of tail --> head --> weight
+    """
+    return dict((u, dict(out_weights(self.g, u)) if u in self.g else dict()) for u in self._added_weights(edges))
+  
+  def add_edges_dynamic(self, edges, in_graph=False, old_weights=None):
+    """Add edges and correct the stored RWR rows with residual push instead of recomputing them
+    
+    Each stored row x is regarded as exact for the graph before insertion, so the new row is
+    x + (push of the residual (1 - c) / c * (W_new - W_old) x). Rows whose residuals all stay below
+    push_tol are reused as they are.
+    If in_graph is set without old_weights, old edge weights are derived by subtracting the added edges,
+    which is only valid for multigraphs (an edge added again to a simple graph does not change it).
     
+    :param in_graph: Whether the edges have already been added to the graph by the caller
+    :param old_weights: weight_snapshot taken before the caller added the edges
+    :return: Set of sources whose rows were updated (the numbers of updated and reused rows are kept in last_update)
+    """
+    edges = list(edges)
+    added = self._added_weights(edges)  # Tail --> head --> added weight
+    if in_graph and old_weights is None and not self.g.is_multigraph():
+      raise ValueError("add_edges_dynamic with in_graph needs old_weights (weight_snapshot) on a simple graph")
+    
+    old = dict()  # Tail --> head --> weight before insertion
+    if old_weights is not None:
+      old = dict((u, old_weights.get(u, dict())) for u in added)
+    elif not in_graph:
+      old = self.weight_snapshot(edges)
+    changed = self.add_edges(edges, in_graph)
+    
+    delta = dict()  # Tail --> list of (head, change of transition probability)
+    for u, heads in added.items():
+      new_w = dict(out_weights(self.g, u))
+      if u not in old:  # Multigraph with the edges already added
+        old[u] = dict((v, w - heads.get(v, 0)) for v, w in new_w.items() if w - heads.get(v, 0) > 0)
+      d_new = float(sum(new_w.values()))
+      d_old = float(sum(old[u].values()))
+      changes = list()
+      for v, w in new_w.items():
+        t_old = old[u].get(v, 0) / d_old if d_old > 0.0 else 0.0
+        if w / d_new != t_old:
+          changes.append((v, w / d_new - t_old))
+      delta[u] = changes
+    
+    if self.method == METHOD_PUSH or self._components is None:
+      candidates = list(self.store.sources())
+    else:
+      candidates = [src for root in changed for src in self.components.members[root] if self.store.has_source(src)]
+    
+    coef = (1 - self.restart_prob) / self.restart_prob
+    weights = dict()  # Out-weights cache shared by all pushes of this batch
+    stats = {"updated": 0, "reused": 0}
+    updated = set()
+    for src in candidates:
+      residual = dict()
+      for u, changes in delta.items():
+        x_u = self.store.get_value(src, u)
+        if x_u == 0.0:
+          continue
+        for v, dt in changes:
+          residual[v] = residual.get(v, 0.0) + coef * x_u * dt
+      if all(abs(r) <= self.push_tol * max(len(self.g.adj[v]), 1) for v, r in residual.items()):
+        stats["reused"] += 1
+        continue
+      correction, _ = forward_push(self.g, src, self.restart_prob, self.push_tol, dict(), residual, weights)
+      self._add_correction(src, correction)
+      updated.add(src)
+      stats["updated"] += 1
+    self.last_update = stats
+    return updated
+  
+  def _add_correction(self, src, correction):
+    """Add score corrections (node ID --> score) to the stored row of the source
+    """
+    node_index, vector = self.store.get_vector(src)
+    if self.method != METHOD_PUSH and src in self.components.parent:
+      target = self._operator(self.components.find(src)).node_index
+    elif all(n in node_index for n in correction):
+      target = node_index
+    else:
+      target = NodeIndex(node_index.nodes + [n for n in correction if n not in node_index])
+    
+    if target is node_index or target.nodes == node_index.nodes:
+      p = np.array(vector, dtype=float)
+    else:  # Component has been merged
+      p = np.zeros(len(target))
+      p[[target.index[n] for n in node_index.nodes]] = vector
+    for n, value in correction.items():
+      p[target.index[n]] += value
+    self._set_vector(src, target, p)
+  
+  def invalidate(self, nodes=None):
+    """Drop cached operators of the components containing the nodes (all components if None)
+    """
+    if nodes is None:
+      self.operators = dict()
+      self.columns = dict()
+      return
+    roots = set(self.components.find(n) for n in nodes)
+    for root in roots:
+      self.operators.pop(root, None)
+    self._drop_columns(roots)
+  
+  def _drop_columns(self, roots):
+    """Drop cached columns whose targets are in the components of the roots
+    """
+    for dst in [dst for dst in self.columns if self.components.find(dst) in roots]:
+      del self.columns[dst]
+  
+  def _operator(self, root):
+    """Get the cached operator of the component, or build it
+    
+    :param root: Root node ID of the component
+    :rtype: ComponentOperator
+    """
+    op = self.operators.get(root)
+    if op is None:
+      op = ComponentOperator(self.g, self.components.members[root])
+      self.operators[root] = op
+    return op
   
   def rwr_single(self, src):
-    for wcc in self.wccs:
-      if src in wcc:
-        g_ = nx.subgraph(self.g, wcc)
-        r_ = RWR(g_)
-        ret = r_.run_exp(src, self.restart_prob, self.og_prob)
-        self.set_values(src, ret)
-        break
+    if self.method == METHOD_PUSH:
+      self._rwr_push(src)
+      return
+    if src in self.g:
+      self._rwr_sources(self._operator(self.components.find(src)), [src])
   
   def rwr_set(self, nodes):
-    remain = set(nodes)
-    # count = 0
-    for wcc in self.wccs:
-      # print(len(remain), len(wcc))
-      found = set(wcc)
-      rc_set = remain & found
-      if rc_set:
-        g_ = nx.subgraph(self.g, wcc)
-        r_ = RWR(g_)
-        for src in rc_set:
-          # print("src " + str(src))
-          ret = r_.run_exp(src, self.restart_prob, self.og_prob)
-          # print(ret)
-          self.set_values(src, ret)
-        remain -= rc_set
-        if not remain:
-          return
-          
+    if self.method == METHOD_PUSH:
+      for src in nodes:
+        self._rwr_push(src)
+      return
+    groups = dict()  # Component root --> sources
+    for src in nodes:
+      if src in self.g:
+        groups.setdefault(self.components.find(src), set()).add(src)
+    if self._parallel():
+      rwr_parallel(self, dict((root, list(sources)) for root, sources in groups.items()), self.processes)
+      return
+    for root, sources in groups.items():
+      self._rwr_sources(self._operator(root), sources)
   
   def rwr_all(self):
-    for wcc in self.wccs:
-      g_ = nx.subgraph(self.g, wcc)
-      r_ = RWR(g_)
-      for src in wcc:
-        ret = r_.run_exp(src, self.restart_prob, self.og_prob)
-        self.set_values(src, ret)
+    if self.method == METHOD_PUSH:
+      self.rwr_set(self.g.nodes())
+      return
+    if self._parallel():
+      rwr_parallel(self, dict((root, list(members)) for root, members in self.components.members.items()),
+                   self.processes)
+      return
+    for root in list(self.components.members):
+      self._rwr_sources(self._operator(root), self.components.members[root])
   
+  def _parallel(self):
+    return self.processes is not None and self.processes > 1 and self.method in (METHOD_POWER, METHOD_BATCH, METHOD_SOLVE)
   
-  def get_dsts(self, src):
-    if not src in self.mat:
-      return set()
+  def _rwr_sources(self, op, sources):
+    """Compute and store RWR scores from the sources in one component
+    
+    :type op: ComponentOperator
+    :param sources: Source nodes in the component of op
+    """
+    r_ = op.rwr
+    node_index = op.node_index
+    if self.method in (METHOD_BATCH, METHOD_SOLVE):
+      solve = self.method == METHOD_SOLVE and len(node_index) <= SOLVE_MAX_NODES
+      sources = list(sources)
+      width = max(1, self.batch_bytes // (BATCH_ARRAYS * 8 * len(node_index)))  # Sources per block
+      for st in range(0, len(sources), width):
+        block = sources[st:st + width]
+        if solve:
+          p = r_.run_solve(block, self.restart_prob, self.og_prob)
+        else:
+          p = r_.run_batch(block, self.restart_prob, self.og_prob)
+        for col, src in enumerate(block):
+          self._set_vector(src, node_index, p[:, col])
+    elif self.method == METHOD_MC:
+      sources = list(sources)
+      width = max(1, self.batch_bytes // (BATCH_ARRAYS * 8 * self.mc_walks))  # Sources per block
+      walker = op.walker
+      for st in range(0, len(sources), width):
+        block = sources[st:st + width]
+        rows = [node_index.index[src] for src in block]
+        for src, (indices, values) in zip(block, walker.run_batch(rows, self.restart_prob, self.mc_walks, self.rng)):
+          self._set_sparse(src, node_index, indices, values)
     else:
-      return self.mat[src].keys()
+      for src in sources:
+        p = r_.run_vector(src, self.restart_prob, self.og_prob)
+        self._set_vector(src, node_index, p)
+  
+  def _rwr_push(self, src):
+    """Compute and store approximate RWR scores from the source with local forward push
+    """
+    estimate, _ = forward_push(self.g, src, self.restart_prob, self.push_tol)
+    node_index = NodeIndex(estimate.keys())
+    self._set_vector(src, node_index, np.fromiter(estimate.values(), dtype=float, count=len(estimate)))
+  
+  def _row_limit(self):
+    """Maximum number of stored destinations per source (None: unlimited)
+    """
+    k = self.top_k
+    if self.max_entries is not None:
+      allowance = max(1, self.max_entries // max(self.num, 1))
+      k = allowance if k is None else min(k, allowance)
+    return k
+  
+  def _set_vector(self, src, node_index, p):
+    """Store the score vector of the source, truncated if top_k, epsilon or max_entries is set
+    """
+    if self.lazy:
+      self._remember(src)
+    if not self.is_truncated():
+      self.store.set_vector(src, node_index, p)
+      return
+    
+    indices, values = truncate_scores(p, self.epsilon, self._row_limit())
+    self.dropped_mass += float(p.sum() - values.sum())
+    self.dropped_entries += len(p) - indices.size
+    self.store.set_sparse(src, node_index, indices, values)
+  
+  def _set_sparse(self, src, node_index, indices, values):
+    """Store the nonzero scores of the source (sorted local indices and scores), truncated like _set_vector
+    """
+    if self.lazy:
+      self._remember(src)
+    if self.is_truncated():
+      keep = np.flatnonzero(values > (self.epsilon or 0.0))
+      k = self._row_limit()
+      if k is not None and keep.size > k:
+        keep = np.sort(keep[np.argpartition(values[keep], -k)[-k:]])
+      self.dropped_mass += float(values.sum() - values[keep].sum())
+      self.dropped_entries += len(node_index) - keep.size
+      indices, values = indices[keep], values[keep]
+    self.store.set_sparse(src, node_index, indices, values)
+  
+  def estimate_error(self, src, dst):
+    """Standard error of the stored score in Monte Carlo mode (0.0 for the other methods)
+    """
+    if self.method != METHOD_MC:
+      return 0.0
+    return float(standard_error(self.store.get_value(src, dst), self.mc_walks))
+  
+  
+  def _remember(self, src):
+    """Mark the row of the source as most recently used, and evict the least recently used rows over cache_rows
+    """
+    self.recent[src] = None
+    self.recent.move_to_end(src)
+    while self.cache_rows is not None and len(self.recent) > self.cache_rows:
+      old, _ = self.recent.popitem(last=False)
+      self.store.remove(old)
+      self.evictions += 1
+  
+  def _require(self, src):
+    """Compute the row of the source if it is not stored (lazy mode)
+    """
+    if self.store.has_source(src):
+      self.hits += 1
+      self._remember(src)
+    elif src in self.g:
+      self.misses += 1
+      self.rwr_single(src)
+  
+  def prewarm(self, sources):
+    """Compute the missing rows of the sources at once (lazy mode), e.g. for the next batch of seeds
+    
+    Only the first cache_rows missing rows are computed, so the batch does not evict its own rows.
+    
+    :return: Number of computed rows
+    """
+    missing = [src for src in sources if not self.store.has_source(src)]
+    if self.cache_rows is not None:
+      missing = missing[:self.cache_rows]
+    self.rwr_set(missing)
+    return len(missing)
+  
+  def cache_stats(self):
+    """Statistics of rows in lazy mode
+    """
+    return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "rows": len(self.recent)}
+  
+  def has_source(self, src):
+    return self.store.has_source(src)
+  
+  def get_dsts(self, src):
+    if self.lazy:
+      self._require(src)
+    return self.store.get_dsts(src)
   
   def set_values(self, src, value_map):
-    if not src in self.mat:
-      d = defaultdict(float)
-      # d.update(dict.fromkeys(self.g.nodes(), 0.0))
-      self.mat[src] = d
-    self.mat[src].update(value_map)
+    self.store.set_values(src, value_map)
   
   def set_value(self, src, dst, value):
-    if not src in self.mat:
-      d = defaultdict(float)
-      # d.update(dict.fromkeys(self.g.nodes(), 0.0))
-      self.mat[src] = d
-    self.mat[src][dst] = value
+    self.store.set_value(src, dst, value)
   
   def get_value(self, src, dst):
-    if not src in self.mat:
-      d = defaultdict(float)
-      # d.update(dict.fromkeys(self.g.nodes(), 0.0))
-      self.mat[src] = d
-      return 0.0
+    if self.lazy:
+      self._require(src)
+    return self.store.get_value(src, dst)
+  
+  def get_vector(self, src):
+    """Get the node index and the dense score vector of the source (None if not computed)
+    """
+    if self.lazy:
+      self._require(src)
+    return self.store.get_vector(src)
+  
+  def get_sparse(self, src):
+    """Get the node index, sorted local indices and scores stored for the source (SparseScoreStore only)
+    """
+    if self.lazy:
+      self._require(src)
+    return self.store.get_sparse(src)
+  
+  def get_column(self, dst):
+    """Get RWR scores of the target from every source (inbound scores), computed without source rows
+    
+    Columns are cached until edges are added to the component of the target.
+    :return: Tuple of NodeIndex of the sources and their score vector
+    """
+    column = self.columns.get(dst)
+    if column is not None:
+      return column
+    if dst not in self.g:
+      column = (NodeIndex([]), np.zeros(0))
+    elif self.method == METHOD_PUSH:
+      estimate = reverse_push(self.g, dst, self.restart_prob, self.push_tol)
+      column = (NodeIndex(estimate.keys()), np.fromiter(estimate.values(), dtype=float, count=len(estimate)))
     else:
-      return self.mat[src][dst]
+      op = self._operator(self.components.find(dst))
+      solve = self.method == METHOD_SOLVE and len(op.node_index) <= SOLVE_MAX_NODES
+      column = (op.node_index, op.rwr.run_column(dst, self.restart_prob, self.og_prob, solve))
+    self.columns[dst] = column
+    return column
+  
+  def get_inbound_value(self, src, dst):
+    """Same as get_value, but uses the column of the target when the row of the source is not computed
+    """
+    if self.store.has_source(src):
+      return self.store.get_value(src, dst)
+    node_index, q = self.get_column(dst)
+    idx = node_index.index.get(src)
+    if idx is None:
+      return 0.0
+    return float(q[idx])
+
+
+class ComponentOperator:
+  """Node index and normalized transition matrix of a component (cached by RWR_WCC)
+  
+  The matrix and the random walker are built on first use, and built again after reset() when edges are added inside the component.
+  """
+  
+  def __init__(self, g, nodes):
+    self.g = g
+    self.node_index = NodeIndex(nodes)
+    self._rwr = None
+    self._walker = None
+  
+  def adjacency(self):
+    return nx.to_scipy_sparse_matrix(self.g, nodelist=self.node_index.nodes)  # adj[i, j]: Weight of i -> j
+  
+  @property
+  def rwr(self):
+    """
+    :rtype: RWR
+    """
+    if self._rwr is None:
+      og_matrix = normalize(self.adjacency(), norm='l1', axis=1).T  # Same as the normalized columns of the reversed graph
+      self._rwr = RWR(operator=(self.node_index, og_matrix))
+    return self._rwr
+  
+  @property
+  def walker(self):
+    """
+    :rtype: MonteCarloWalker
+    """
+    if self._walker is None:
+      self._walker = MonteCarloWalker(self.adjacency())
+    return self._walker
+  
+  def reset(self):
+    self._rwr = None
+    self._walker = None
 
 
 class RWR:
-  def __init__(self, graph):
-    self._build_matrices(graph.to_directed().reverse()) ## TODO: edges need to be reversed.
+  def __init__(self, graph=None, operator=None):
+    """
+    :param graph: Input graph
+    :param operator: Tuple of NodeIndex and normalized transition matrix used instead of graph
+    """
+    if operator is None:
+      self._build_matrices(graph.to_directed().reverse()) ## TODO: edges need to be reversed.
+    else:
+      self.OG = None
+      self.node_index, self.og_matrix = operator
+      self.nodelist = self.node_index.nodes
+    self.og_csr = None  # Row-major copy of og_matrix for batches
+    self.lu = None  # LU factorization of I - (1 - restart_prob) * og_matrix
+    self.lu_restart_prob = None
     self.restart_prob = 0.7
     self.og_prob = 0.1
   
   def _build_matrices(self, graph):
     self.OG = graph
-    self.nodelist = list(self.OG.nodes())
+    self.node_index = NodeIndex(self.OG.nodes())
+    self.nodelist = self.node_index.nodes
     # og_not_normalized = nx.to_numpy_matrix(graph)
     og_not_normalized = nx.to_scipy_sparse_matrix(graph)
     self.og_matrix = self._normalize_cols(og_not_normalized)
@@ -147,6 +655,24 @@ class RWR:
     return normalize(og_not_normalized, norm='l1', axis=0)
   
   def run_exp(self, source, restart_prob, og_prob):
+    """
+    :return: Dict of target --> score (probability), not ordered by score
+    """
+    p_t = self.run_vector(source, restart_prob, og_prob)
+    return dict(zip(self.nodelist, p_t.tolist()))
+  
+  def run_sparse(self, source, restart_prob, og_prob):
+    """Same as run_vector, but returns only the nonzero scores
+    
+    :return: Tuple of indices in nodelist (ascending) and scores
+    """
+    p_t = self.run_vector(source, restart_prob, og_prob)
+    indices = np.flatnonzero(p_t)
+    return indices, p_t[indices]
+  
+  def run_vector(self, source, restart_prob, og_prob):
+    """Same as run_exp, but returns the probability vector ordered by nodelist
+    """
     self.restart_prob = restart_prob
     self.og_prob = og_prob
     
@@ -160,16 +686,87 @@ class RWR:
       # print("diff_norm")
       diff_norm = np.linalg.norm(np.subtract(p_t_1, p_t), 1)
       p_t = p_t_1
+    return p_t
+  
+  def run_batch(self, sources, restart_prob, og_prob):
+    """Run power iterations for multiple sources at once (sparse matrix x dense matrix)
+    
+    Columns are frozen as soon as they converge, so each column equals the result of run_vector.
+    :return: Probability matrix (rows: nodelist, columns: sources)
+    """
+    self.restart_prob = restart_prob
+    self.og_prob = og_prob
+    
+    rows = np.array([self._source_index(source) for source in sources], dtype=np.int64)
+    result = np.empty((len(self.nodelist), len(sources)), order='F')  # Contiguous columns
+    active = np.arange(len(sources))  # Columns not converged yet
+    p_t = np.zeros(result.shape)
+    p_t[rows, active] = 1.0
     
-    result = {}  ## target, score (probability)
-    for node, prob in self._generate_rank_list(p_t):
-      result[node] = prob
+    if self.og_csr is None:
+      self.og_csr = self.og_matrix.tocsr()  # Row-wise products suit C-ordered dense blocks
+    while active.size:
+      p_t_1 = self.og_csr.dot(p_t) * (1 - self.restart_prob)
+      p_t_1[rows[active], np.arange(active.size)] += self.restart_prob  # Restart vectors are one-hot
+      diff = np.subtract(p_t_1, p_t, out=p_t)  # p_t is no longer needed
+      diff_norm = np.abs(diff, out=diff).sum(axis=0)
+      done = diff_norm <= CONV_THRESHOLD
+      if done.any():
+        result[:, active[done]] = p_t_1[:, done]
+        active = active[~done]
+        p_t_1 = p_t_1[:, ~done]
+      p_t = p_t_1
     return result
   
-  def _generate_rank_list(self, p_t):
-    gene_probs = zip(self.OG.nodes(), p_t.tolist())
-    for s in sorted(gene_probs, key=lambda x: x[1], reverse=True):
-      yield s[0], s[1]
+  def run_solve(self, sources, restart_prob, og_prob):
+    """Solve (I - (1 - c) W) p = c e for multiple sources with a sparse LU factorization
+    
+    The factorization is computed on first use and reused for every later call with the same restart probability.
+    :return: Probability matrix (rows: nodelist, columns: sources)
+    """
+    self.restart_prob = restart_prob
+    self.og_prob = og_prob
+    
+    rows = np.array([self._source_index(source) for source in sources], dtype=np.int64)
+    rhs = np.zeros((len(self.nodelist), len(sources)), order='F')
+    rhs[rows, np.arange(len(sources))] = restart_prob
+    p = self._factorize(restart_prob).solve(rhs)
+    return np.maximum(p, 0.0, out=p)  # Remove negative round-off errors
+  
+  def run_column(self, target, restart_prob, og_prob, solve=False):
+    """Scores of the target from every source, q = c e + (1 - c) W^T q (a column of the RWR matrix)
+    
+    :param solve: Solve with the LU factorization (transposed) instead of power iteration
+    :return: Score vector ordered by nodelist (q[s]: score of the target from source s)
+    """
+    self.restart_prob = restart_prob
+    self.og_prob = og_prob
+    
+    q_0 = np.zeros(len(self.nodelist))
+    q_0[self._source_index(target)] = restart_prob
+    if solve:
+      q = self._factorize(restart_prob).solve(q_0, trans='T')
+      return np.maximum(q, 0.0, out=q)
+    
+    og_t = self.og_matrix.T.tocsr()
+    q = q_0.copy()
+    diff_norm = 1
+    while diff_norm > CONV_THRESHOLD:
+      q_1 = og_t.dot(q) * (1 - restart_prob) + q_0
+      diff_norm = np.linalg.norm(q_1 - q, 1)
+      q = q_1
+    return q
+  
+  def _factorize(self, restart_prob):
+    """LU factorization of I - (1 - restart_prob) * og_matrix (cached)
+    """
+    if self.lu is None or self.lu_restart_prob != restart_prob:
+      a = sp.identity(len(self.nodelist), format='csc') - (1 - restart_prob) * self.og_matrix
+      ## The matrix is column diagonally dominant, so the diagonal pivots are kept with a fill-reducing ordering of A + A^T
+      self.lu = splu(sp.csc_matrix(a), permc_spec="MMD_AT_PLUS_A", diag_pivot_thresh=0.0,
+                     options=dict(SymmetricMode=True))
+      self.lu_restart_prob = restart_prob
+    return self.lu
   
   def _calculate_next_p(self, p_t, p_0):
     # print("_calculate_next_p")
@@ -179,15 +776,20 @@ class RWR:
     restart = p_0 * self.restart_prob
     return np.add(no_restart, restart)
   
+  def _source_index(self, source_id):
+    source_index = self.node_index.index.get(source_id)
+    if source_index is None:
+      sys.exit("Source node {} is not in original graph. Exiting.".format(source_id))
+    return source_index
+  
   def _set_up_p0(self, sources):
-    p_0 = [0.0] * self.OG.number_of_nodes()
+    p_0 = np.zeros(len(self.nodelist))
     for source_id in sources:
-      try:
-        source_index = self.nodelist.index(source_id)
-        p_0[source_index] = 1.0 / len(sources)
-      except ValueError:
+      source_index = self.node_index.index.get(source_id)
+      if source_index is None:
         sys.exit("Source node {} is not in original graph. Source: {}. Exiting.".format(source_id, sources))
-    return np.array(p_0)
+      p_0[source_index] = 1.0 / len(sources)
+    return p_0
 
 
 def run_small():
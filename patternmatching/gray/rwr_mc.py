@@ -0,0 +1,77 @@
+"""
+Monte Carlo RWR estimation with vectorized random walks
+
+Each walk starts at the source and stops at each step with the restart probability, so the end point of
+a walk follows the RWR distribution of the source. All walks of a block of sources move at once over a
+CSR adjacency: the next hop of every walker is sampled with one searchsorted over row-offset cumulative
+transition probabilities. Walks reaching a dangling vertex are lost (same as the power iteration).
+"""
+
+import numpy as np
+
+MC_WALKS = 1000  # Default number of walks per source
+
+
+class MonteCarloWalker:
+  """Vectorized random walks over the CSR adjacency of a component
+  """
+
+  def __init__(self, adj):
+    """
+    :param adj: Sparse adjacency matrix (adj[i, j]: weight of i -> j)
+    """
+    adj = adj.tocsr()
+    adj.sum_duplicates()
+    self.n = adj.shape[0]
+    self.indptr = adj.indptr
+    self.indices = adj.indices
+    degrees = np.diff(adj.indptr)
+    weights = np.asarray(adj.data, dtype=np.float64)
+    rows = np.repeat(np.arange(self.n), degrees)
+    totals = np.bincount(rows, weights=weights, minlength=self.n)
+    self.dangling = totals <= 0.0
+    ## cum[k] = row(k) + (cumulative transition probability of the row up to k), so rows do not overlap
+    cum = np.concatenate(([0.0], np.cumsum(weights)))
+    cum = cum[1:] - np.repeat(cum[self.indptr[:-1]], degrees)  # Restart the sum at each row
+    row_totals = totals[rows]
+    np.divide(cum, row_totals, out=cum, where=row_totals > 0.0)  # Rows of dangling vertices are never sampled
+    cum += rows
+    self.cum = cum
+
+  def step(self, pos, rng):
+    """Move every walker to a random outgoing neighbor (pos must not contain dangling vertices)
+    """
+    k = np.searchsorted(self.cum, pos + rng.random(pos.size), side='right')
+    np.clip(k, self.indptr[pos], self.indptr[pos + 1] - 1, out=k)  # Round-off at the ends of a row
+    return self.indices[k]
+
+  def run_batch(self, rows, restart_prob, walks, rng):
+    """Estimate RWR scores from the sources by the end points of their walks
+
+    :param rows: Local indices of the sources
+    :param walks: Number of walks per source
+    :param rng: numpy.random.Generator
+    :return: List of tuples (sorted local indices, scores) for each source
+    """
+    num = len(rows)
+    pos = np.repeat(np.asarray(rows, dtype=np.int64), walks)
+    owner = np.repeat(np.arange(num, dtype=np.int64), walks)
+    ends = list()  # Keys (owner * n + end point) of finished walks
+    while pos.size:
+      stop = rng.random(pos.size) < restart_prob
+      ends.append(owner[stop] * self.n + pos[stop])
+      alive = ~stop & ~self.dangling[pos]
+      pos = self.step(pos[alive], rng)
+      owner = owner[alive]
+
+    keys, counts = np.unique(np.concatenate(ends), return_counts=True)
+    bounds = np.searchsorted(keys, np.arange(num + 1) * self.n)
+    scores = counts / float(walks)
+    return [(keys[bounds[i]:bounds[i + 1]] - i * self.n, scores[bounds[i]:bounds[i + 1]]) for i in range(num)]
+
+
+def standard_error(p, walks):
+  """Standard error of Monte Carlo scores p estimated with the number of walks (binomial proportions)
+  """
+  p = np.asarray(p, dtype=np.float64)
+  return np.sqrt(p * (1.0 - p) / walks)
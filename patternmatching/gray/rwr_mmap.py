@@ -0,0 +1,199 @@
+"""
+Versioned on-disk format of RWR score stores that can be memory-mapped
+
+A store is saved as a directory:
+  meta.json            Format version, store type, dtype, codec and RWR parameters
+  index.pickle         Node list and source list of each block
+  graph.pickle         Input graph (optional)
+  block_<i>.npy        Dense block: scores of the sources (rows) over the nodes of the component (columns)
+  sparse_indptr.npy, sparse_indices.npy, sparse_values.npy
+                       CSR rows of all sparse blocks in index order (local indices in the node list of each block)
+
+Score arrays are opened with np.load(mmap_mode='c'), so processes loading the same directory share
+pages through the OS cache, and rows updated later are copied on write (the files are never modified).
+"""
+
+import json
+import os
+import pickle
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+
+from patternmatching.gray.rwr_store import NodeIndex, DictScoreStore, ArrayScoreStore, SparseScoreStore, LogQuantizer, \
+  _Block
+
+FORMAT_NAME = "rwr-store"
+FORMAT_VERSION = 2  # 2: Score codec in meta.json
+META_FILE = "meta.json"
+INDEX_FILE = "index.pickle"
+GRAPH_FILE = "graph.pickle"
+
+KIND_DENSE = "dense"
+KIND_SPARSE = "sparse"
+
+
+def _block_path(path, num):
+  return os.path.join(path, "block_%05d.npy" % num)
+
+
+def _sparse_path(path, name):
+  return os.path.join(path, "sparse_%s.npy" % name)
+
+
+def _dense_blocks(store):
+  """
+  :type store: ArrayScoreStore
+  """
+  for block in store.blocks.values():
+    sources = sorted(block.rows, key=block.rows.get)
+    rows = [block.rows[src] for src in sources]
+    yield block.node_index.nodes, sources, KIND_DENSE, (block.data[rows],)
+
+
+def _sparse_blocks(store):
+  """
+  :type store: SparseScoreStore
+  """
+  groups = OrderedDict()  # id(NodeIndex) --> (NodeIndex, sources)
+  for src, row in store.rows.items():
+    groups.setdefault(id(row[0]), (row[0], list()))[1].append(src)
+  for node_index, sources in groups.values():
+    yield node_index.nodes, sources, KIND_SPARSE, [store.rows[src][1:] for src in sources]
+
+
+def _dict_blocks(store):
+  """
+  :type store: DictScoreStore
+  """
+  for src, row in store.mat.items():
+    values = np.fromiter(row.values(), dtype=np.float64, count=len(row))
+    yield list(row.keys()), [src], KIND_SPARSE, [(np.arange(len(row), dtype=np.int32), values)]
+
+
+def save_store(store, path, graph=None, params=None):
+  """Save a score store (and optionally the graph) into a directory
+
+  :param store: DictScoreStore, ArrayScoreStore or SparseScoreStore
+  :param path: Output directory (replaced as a whole if it exists)
+  :param graph: Input graph stored with the scores
+  :param params: JSON-serializable dict of additional parameters (e.g. RWR parameters)
+  """
+  if isinstance(store, ArrayScoreStore):
+    store_type, blocks, dtype = "array", _dense_blocks(store), store.storage_dtype()
+  elif isinstance(store, SparseScoreStore):
+    store_type, blocks, dtype = "sparse", _sparse_blocks(store), store.storage_dtype()
+  elif isinstance(store, DictScoreStore):
+    store_type, blocks, dtype = "sparse", _dict_blocks(store), np.float64
+  else:
+    raise TypeError("Unsupported score store: %s" % type(store).__name__)
+  score_dtype = getattr(store, "dtype", np.float64)
+  codec = getattr(store, "codec", None)
+
+  ## Write into a temporary directory first: the store being saved may be memory-mapped from the old files
+  path = path.rstrip(os.sep)
+  tmp_path = path + ".tmp"
+  if os.path.isdir(tmp_path):
+    shutil.rmtree(tmp_path)
+  os.makedirs(tmp_path)
+  index = list()
+  sparse_rows = list()  # Tuples of (indices, values)
+  for num, (nodes, sources, kind, arrays) in enumerate(blocks):
+    index.append((nodes, sources, kind))
+    if kind == KIND_DENSE:
+      np.save(_block_path(tmp_path, num), np.ascontiguousarray(arrays[0]))
+    else:
+      sparse_rows.extend(arrays)
+  if sparse_rows:
+    indptr = np.zeros(len(sparse_rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(indices) for indices, _ in sparse_rows])
+    np.save(_sparse_path(tmp_path, "indptr"), indptr)
+    np.save(_sparse_path(tmp_path, "indices"), np.concatenate([indices for indices, _ in sparse_rows]).astype(np.int32))
+    np.save(_sparse_path(tmp_path, "values"), np.concatenate([values for _, values in sparse_rows]).astype(dtype))
+
+  with open(os.path.join(tmp_path, INDEX_FILE), "wb") as wf:
+    pickle.dump(index, wf, protocol=pickle.HIGHEST_PROTOCOL)
+  if graph is not None:
+    with open(os.path.join(tmp_path, GRAPH_FILE), "wb") as wf:
+      pickle.dump(graph, wf, protocol=pickle.HIGHEST_PROTOCOL)
+  meta = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "store": store_type,
+          "dtype": np.dtype(score_dtype).name, "blocks": len(index), "params": params or dict(),
+          "codec": None if codec is None else {"name": "log16", "min_score": codec.min_score}}
+  with open(os.path.join(tmp_path, META_FILE), "w") as wf:
+    json.dump(meta, wf)
+
+  ## Swap directories (mapped pages of the old files stay valid until they are unmapped)
+  if os.path.isdir(path):
+    old_path = path + ".old"
+    if os.path.isdir(old_path):
+      shutil.rmtree(old_path)
+    os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path)
+  else:
+    os.rename(tmp_path, path)
+
+
+def read_meta(path):
+  with open(os.path.join(path, META_FILE), "r") as rf:
+    meta = json.load(rf)
+  if meta.get("format") != FORMAT_NAME:
+    raise ValueError("Not an RWR store directory: %s" % path)
+  if meta.get("version", 0) > FORMAT_VERSION:
+    raise ValueError("Unsupported RWR store version %d (supported up to %d)" % (meta["version"], FORMAT_VERSION))
+  return meta
+
+
+def load_store(path, mmap_mode="c"):
+  """Open a score store saved by save_store
+
+  :param path: Store directory
+  :param mmap_mode: Memory-map mode of the score arrays ('c': copy-on-write, 'r': read-only, None: read into memory)
+  :return: Tuple of score store, graph (None if not saved) and metadata dict
+  """
+  meta = read_meta(path)
+  dtype = np.dtype(meta["dtype"]).type
+  codec = None
+  if meta.get("codec") is not None:
+    codec = LogQuantizer(meta["codec"]["min_score"])
+  with open(os.path.join(path, INDEX_FILE), "rb") as rf:
+    index = pickle.load(rf)
+
+  if meta["store"] == "array":
+    store = ArrayScoreStore(dtype=dtype, codec=codec)
+  else:
+    store = SparseScoreStore(dtype=dtype, codec=codec)
+
+  if any(kind == KIND_SPARSE for _, _, kind in index):
+    indptr, indices, values = [np.load(_sparse_path(path, name), mmap_mode=mmap_mode)
+                               for name in ("indptr", "indices", "values")]
+    indptr = np.asarray(indptr).tolist()
+  row = 0  # Next row of the sparse blocks
+  for num, (nodes, sources, kind) in enumerate(index):
+    node_index = NodeIndex(nodes)
+    if kind == KIND_DENSE:
+      block = _Block.__new__(_Block)
+      block.node_index = node_index
+      block.data = np.load(_block_path(path, num), mmap_mode=mmap_mode)
+      block.rows = dict((src, row) for row, src in enumerate(sources))
+      block.free = list()
+      store.blocks[id(node_index)] = block
+      for src in sources:
+        store.owner[src] = block
+    else:
+      for src in sources:
+        st, ed = indptr[row], indptr[row + 1]
+        store.rows[src] = (node_index, indices[st:ed], values[st:ed])
+        row += 1
+
+  graph = None
+  graph_file = os.path.join(path, GRAPH_FILE)
+  if os.path.isfile(graph_file):
+    with open(graph_file, "rb") as rf:
+      graph = pickle.load(rf)
+  return store, graph, meta
+
+
+def is_store(path):
+  return os.path.isfile(os.path.join(path, META_FILE))
@@ -0,0 +1,227 @@
+"""
+Parallel RWR computation over a process pool
+
+The transition matrix of the whole graph is built once with the nodes ordered by component, so each
+component is a contiguous diagonal block of the CSR arrays. The arrays are placed in shared memory,
+and the workers slice their blocks from there instead of receiving pickled matrices. Components are
+scheduled largest first (large ones split into blocks of sources).
+
+The workers convert their rows into the storage format of the score store (dtype or codec). Full rows
+are computed in rounds of at most batch_bytes: the workers write them into a shared block of the
+round, which the parent copies into the store and frees before the next round. Truncated rows (top_k,
+epsilon or max_entries) are truncated by the workers and sent back, so no dense block is shared.
+"""
+
+from multiprocessing import Pool, cpu_count
+from multiprocessing import shared_memory
+
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+from patternmatching.gray.rwr_store import NodeIndex
+
+_shared = dict()  # Name --> (SharedMemory, array) attached in each worker
+
+
+def _to_shared(array):
+  shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+  view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+  view[...] = array
+  return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _attach(spec):
+  name, shape, dtype = spec
+  if name not in _shared:
+    shm = shared_memory.SharedMemory(name=name)
+    _shared[name] = (shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf))
+  return _shared[name][1]
+
+
+def _init_worker(specs):
+  for spec in specs:
+    _attach(spec)
+
+
+def _encode(p, dtype, codec):
+  """Scores in the storage format of the score store
+  """
+  if codec is not None:
+    return codec.encode(p)
+  return p.astype(dtype, copy=False)
+
+
+def _run_task(args):
+  """Compute the rows of a block of sources in one component
+
+  Full rows are written into the shared result block of the round, truncated rows are sent back.
+  """
+  from patternmatching.gray import rwr  # Imported here to avoid a circular import
+  specs, out_spec, jobs, restart_prob, og_prob, solve_max_nodes, dtype, codec, limits = args
+  indptr, indices, data = [_attach(spec) for spec in specs]
+  shm = out = None
+  if out_spec is not None:  # Attached for this task only (the block is freed after the round)
+    name, shape, out_dtype = out_spec
+    shm = shared_memory.SharedMemory(name=name)
+    out = np.ndarray(shape, dtype=np.dtype(out_dtype), buffer=shm.buf)
+  results = list()  # Tuples of (job ID, truncated rows)
+  try:
+    for jid, st, ed, rows, offset in jobs:
+      n = ed - st
+      sub_indptr = indptr[st:ed + 1] - indptr[st]
+      og = sp.csr_matrix((data[indptr[st]:indptr[ed]], indices[indptr[st]:indptr[ed]] - st, sub_indptr), shape=(n, n))
+      r_ = rwr.RWR(operator=(NodeIndex(range(n)), og))
+      if n <= solve_max_nodes:
+        p = r_.run_solve(rows, restart_prob, og_prob)
+      else:
+        p = r_.run_batch(rows, restart_prob, og_prob)
+      if limits is None:
+        out[offset:offset + n * len(rows)].reshape(len(rows), n)[...] = _encode(p.T, dtype, codec)
+        continue
+      truncated = list()  # Tuples of (indices, stored values, dropped mass, dropped entries)
+      for col in range(len(rows)):
+        vector = p[:, col]
+        idx, values = rwr.truncate_scores(vector, *limits)
+        truncated.append((idx.astype(np.int32), _encode(values, dtype, codec), float(vector.sum() - values.sum()),
+                          n - idx.size))
+      results.append((jid, truncated))
+  finally:
+    out = None
+    if shm is not None:
+      shm.close()
+  return results
+
+
+def _pack(jobs, num_tasks):
+  """Group jobs (sorted by cost, largest first) into tasks of similar cost
+  """
+  total = sum((ed - st) * len(rows) for _, st, ed, rows, _ in jobs)
+  target = max(1, total // max(num_tasks, 1))
+  tasks, current, cost = list(), list(), 0
+  for job in jobs:
+    current.append(job)
+    cost += (job[2] - job[1]) * len(job[3])
+    if cost >= target:
+      tasks.append(current)
+      current, cost = list(), 0
+  if current:
+    tasks.append(current)
+  return tasks
+
+
+def _rounds(jobs, max_bytes, itemsize):
+  """Split jobs into rounds whose full rows fit in max_bytes (at least one job per round)
+  """
+  rounds, current, size = list(), list(), 0
+  for job in jobs:
+    job_bytes = (job[1] - job[0]) * len(job[2]) * itemsize
+    if current and size + job_bytes > max_bytes:
+      rounds.append(current)
+      current, size = list(), 0
+    current.append(job)
+    size += job_bytes
+  if current:
+    rounds.append(current)
+  return rounds
+
+
+def rwr_parallel(rwr_wcc, groups, processes=None):
+  """Compute RWR rows of the sources grouped by component with a process pool
+
+  :type rwr_wcc: patternmatching.gray.rwr.RWR_WCC
+  :param groups: Dict of component root --> list of sources in the component
+  :param processes: Number of worker processes (None: number of CPUs)
+  """
+  from patternmatching.gray import rwr  # Imported here to avoid a circular import
+  processes = processes or cpu_count()
+  store = rwr_wcc.store
+  codec = getattr(store, "codec", None)
+  dtype = np.dtype(store.storage_dtype() if hasattr(store, "storage_dtype") else np.float64)
+  limits = (rwr_wcc.epsilon, rwr_wcc._row_limit()) if rwr_wcc.is_truncated() else None
+  roots = sorted(groups, key=lambda root: len(rwr_wcc.components.members[root]), reverse=True)
+
+  ## Nodes ordered by component, so each component is a diagonal block
+  nodes, spans = list(), dict()  # Root --> (start, end)
+  for root in roots:
+    members = rwr_wcc._operator(root).node_index.nodes
+    spans[root] = (len(nodes), len(nodes) + len(members))
+    nodes.extend(members)
+  adj = nx.to_scipy_sparse_matrix(rwr_wcc.g, nodelist=nodes)
+  og = normalize(adj, norm='l1', axis=1).T.tocsr()  # Same as ComponentOperator
+
+  ## Jobs of at most batch_bytes of working arrays, and a round of full rows holds a job per process
+  jobs = list()  # Tuples of (start, end, local source rows, sources, node index)
+  for root in roots:
+    st, ed = spans[root]
+    node_index = rwr_wcc._operator(root).node_index
+    sources = groups[root]
+    width = max(1, rwr_wcc.batch_bytes // (max(rwr.BATCH_ARRAYS * 8, processes * dtype.itemsize) * (ed - st)))
+    for i in range(0, len(sources), width):
+      block = sources[i:i + width]
+      jobs.append((st, ed, [node_index.index[src] for src in block], block, node_index))
+  jobs.sort(key=lambda job: (job[1] - job[0]) * len(job[2]), reverse=True)
+  rounds = [jobs] if limits is not None else _rounds(jobs, rwr_wcc.batch_bytes, dtype.itemsize)
+
+  shms, specs = list(), list()
+  try:
+    for array in (og.indptr.astype(np.int64), og.indices.astype(np.int64), og.data):
+      shm, spec = _to_shared(array)
+      shms.append(shm)
+      specs.append(spec)
+    del adj, og
+    solve_max_nodes = rwr.SOLVE_MAX_NODES if rwr_wcc.method == rwr.METHOD_SOLVE else 0
+    with Pool(processes, initializer=_init_worker, initargs=(specs,)) as pool:
+      for round_jobs in rounds:
+        _run_round(rwr_wcc, pool, specs, round_jobs, processes, solve_max_nodes, dtype, codec, limits)
+  finally:
+    for shm in shms:
+      shm.close()
+      shm.unlink()
+
+
+def _run_round(rwr_wcc, pool, specs, jobs, processes, solve_max_nodes, dtype, codec, limits):
+  """Compute the jobs of a round and store their rows (the shared block of full rows is freed afterwards)
+  """
+  options = {"encoded": True} if codec is not None else {}  # Rows are already in the storage format
+  offsets = list()  # Job ID --> offset of the full rows in the shared block
+  size = 0
+  for st, ed, rows, _, _ in jobs:
+    offsets.append(size)
+    if limits is None:
+      size += (ed - st) * len(rows)
+  shm = out_spec = None
+  if limits is None:
+    shm = shared_memory.SharedMemory(create=True, size=max(size * dtype.itemsize, 1))
+    out_spec = (shm.name, (size,), dtype.str)
+  try:
+    tasks = [(specs, out_spec, task, rwr_wcc.restart_prob, rwr_wcc.og_prob, solve_max_nodes, dtype, codec, limits)
+             for task in _pack([(jid, st, ed, rows, offsets[jid]) for jid, (st, ed, rows, _, _) in enumerate(jobs)],
+                               processes * 4)]
+    for results in pool.imap_unordered(_run_task, tasks):
+      for jid, truncated in results:  # Stored as soon as they arrive
+        _, _, _, sources, node_index = jobs[jid]
+        for src, (indices, values, mass, dropped) in zip(sources, truncated):
+          if rwr_wcc.lazy:
+            rwr_wcc._remember(src)
+          rwr_wcc.dropped_mass += mass
+          rwr_wcc.dropped_entries += dropped
+          rwr_wcc.store.set_sparse(src, node_index, indices, values, **options)
+    if shm is not None:
+      _store_rows(rwr_wcc, np.ndarray((size,), dtype=dtype, buffer=shm.buf), jobs, offsets, options)
+  finally:
+    if shm is not None:
+      shm.close()
+      shm.unlink()
+
+
+def _store_rows(rwr_wcc, out, jobs, offsets, options):
+  """Copy the full rows of a round into the score store (no views on the shared block are left on return)
+  """
+  for jid, (st, ed, rows, sources, node_index) in enumerate(jobs):
+    block = out[offsets[jid]:offsets[jid] + (ed - st) * len(rows)].reshape(len(rows), ed - st)
+    for src, row in zip(sources, block):  # The store copies the row
+      if rwr_wcc.lazy:
+        rwr_wcc._remember(src)
+      rwr_wcc.store.set_vector(src, node_index, row, **options)
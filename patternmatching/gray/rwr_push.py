@@ -0,0 +1,124 @@
+"""
+Local push-based approximate RWR (personalized PageRank) from a single source
+
+Andersen, Reid, Fan Chung, and Kevin Lang. "Local graph partitioning using PageRank vectors."
+47th Annual IEEE Symposium on Foundations of Computer Science (FOCS'06). IEEE, 2006.
+
+Andersen, Reid, et al. "Local computation of PageRank contributions."
+International Workshop on Algorithms and Models for the Web-Graph (WAW'07). Springer, 2007.
+
+The scores follow the same random walk as RWR (walkers move along outgoing edges, weighted like
+nx.to_scipy_sparse_matrix), and the cost only depends on the tolerance, not on the component size.
+Forward push computes the scores from one source, and reverse push the scores of one target from every source.
+"""
+
+from collections import deque
+
+PUSH_TOLERANCE = 1.0e-6  # Residual tolerance per outgoing neighbor
+
+
+def out_weights(g, u):
+  """Outgoing neighbors of u and their edge weights (parallel edges are summed)
+
+  :return: List of tuples (neighbor, weight)
+  """
+  if g.is_multigraph():
+    return [(v, sum(d.get("weight", 1) for d in keydict.values())) for v, keydict in g.adj[u].items()]
+  return [(v, d.get("weight", 1)) for v, d in g.adj[u].items()]
+
+
+def in_weights(g, u):
+  """Incoming neighbors of u and their edge weights (parallel edges are summed)
+
+  :return: List of tuples (neighbor, weight)
+  """
+  pred = g.pred[u] if g.is_directed() else g.adj[u]
+  if g.is_multigraph():
+    return [(v, sum(d.get("weight", 1) for d in keydict.values())) for v, keydict in pred.items()]
+  return [(v, d.get("weight", 1)) for v, d in pred.items()]
+
+
+def forward_push(g, source, restart_prob, tol=PUSH_TOLERANCE, estimate=None, residual=None, weights=None):
+  """Approximate RWR scores from the source with forward push
+
+  Keeps the invariant p = estimate + sum_u residual[u] * p_u, and pushes vertices until every residual
+  is below tol times its number of outgoing neighbors. Existing estimate and residual can be given to resume pushing.
+
+  :param g: Input graph
+  :param source: Source node ID
+  :param restart_prob: Restart probability
+  :param tol: Residual tolerance per outgoing neighbor
+  :param weights: Cache of node ID --> (out-weights, total out-weight) shared by many sources of the same graph
+  :return: Tuple of estimate and residual dicts (node ID --> score)
+  """
+  if estimate is None:
+    estimate = dict()
+  if residual is None:
+    residual = {source: 1.0}
+  if weights is None:
+    weights = dict()  # Node ID --> (out-weights, total out-weight)
+
+  def above(u):
+    ws = weights.get(u)
+    num = len(ws[0]) if ws is not None else len(g.adj[u])
+    return abs(residual.get(u, 0.0)) > tol * max(num, 1)
+
+  queue = deque(u for u in residual if above(u))
+  queued = set(queue)
+  while queue:
+    u = queue.popleft()
+    queued.discard(u)
+    r_u = residual.pop(u, 0.0)
+    estimate[u] = estimate.get(u, 0.0) + restart_prob * r_u
+    if u not in weights:
+      ws = out_weights(g, u)
+      weights[u] = (ws, float(sum(w for _, w in ws)))
+    ws, total = weights[u]
+    if total <= 0.0:  # Dangling vertex: the walk stops here
+      continue
+    spread = (1 - restart_prob) * r_u / total
+    for v, w in ws:
+      residual[v] = residual.get(v, 0.0) + spread * w
+      if v not in queued and above(v):
+        queue.append(v)
+        queued.add(v)
+  return estimate, residual
+
+
+def reverse_push(g, target, restart_prob, tol=PUSH_TOLERANCE, weights=None):
+  """Approximate RWR scores of the target from every source with reverse push
+
+  Keeps the invariant p_s(target) = estimate[s] + sum_u p_s(u) * residual[u], and pushes vertices until
+  every residual is below tol, so each estimate is at most tol below the exact score.
+
+  :param g: Input graph
+  :param target: Target node ID
+  :param restart_prob: Restart probability
+  :param tol: Residual tolerance
+  :param weights: Cache of node ID --> (out-weights, total out-weight) shared with forward_push
+  :return: Dict of source node ID --> score of the target
+  """
+  if weights is None:
+    weights = dict()  # Node ID --> (out-weights, total out-weight)
+
+  def total(v):
+    if v not in weights:
+      ws = out_weights(g, v)
+      weights[v] = (ws, float(sum(w for _, w in ws)))
+    return weights[v][1]
+
+  estimate = dict()
+  residual = {target: 1.0}
+  queue = deque([target])
+  queued = {target}
+  while queue:
+    u = queue.popleft()
+    queued.discard(u)
+    r_u = residual.pop(u, 0.0)
+    estimate[u] = estimate.get(u, 0.0) + restart_prob * r_u
+    for v, w in in_weights(g, u):  # Walkers move from v to u with probability w / total(v)
+      residual[v] = residual.get(v, 0.0) + (1 - restart_prob) * r_u * w / total(v)
+      if v not in queued and residual[v] > tol:
+        queue.append(v)
+        queued.add(v)
+  return estimate
@@ -0,0 +1,387 @@
+"""
+Score store backends for RWR_WCC
+
+DictScoreStore keeps RWR scores as nested dicts (source --> destination --> score).
+ArrayScoreStore keeps the scores of each weakly connected component as rows of a contiguous
+NumPy array, with one node index shared by all sources of the component.
+SparseScoreStore keeps only selected destinations of each source as sorted index and score arrays
+(used for truncated rows).
+Array and sparse stores can keep scores in reduced precision: float32 with dtype, or uint16 codes on a
+log scale with LogQuantizer (scores are decoded to floats by get_value and get_vector).
+"""
+
+import math
+import numpy as np
+
+INIT_ROWS = 4  # Initial number of rows allocated for each component block
+QUANT_MIN_SCORE = 1.0e-12  # Smallest nonzero score of LogQuantizer (smaller scores become 0.0)
+QUANT_LEVELS = 65535  # Number of nonzero uint16 codes
+
+
+class LogQuantizer:
+  """Scores in [min_score, 1] as uint16 codes on a log scale (code 0: score below min_score)
+
+  The relative error of a decoded score is at most about -log(min_score) / (2 * QUANT_LEVELS) (2.1e-4 by default).
+  """
+
+  dtype = np.uint16
+
+  def __init__(self, min_score=QUANT_MIN_SCORE):
+    self.min_score = min_score
+    self.log_min = math.log(min_score)
+    self.scale = (QUANT_LEVELS - 1) / -self.log_min  # Codes per unit of log score
+
+  def encode(self, values):
+    values = np.asarray(values, dtype=np.float64)
+    codes = np.zeros(values.shape, dtype=self.dtype)
+    nonzero = values >= self.min_score
+    codes[nonzero] = np.rint((np.log(np.minimum(values[nonzero], 1.0)) - self.log_min) * self.scale) + 1
+    return codes
+
+  def decode(self, codes):
+    codes = np.asarray(codes)
+    values = np.exp((codes - 1.0) / self.scale + self.log_min)
+    values[codes == 0] = 0.0
+    return values
+
+  def decode_one(self, code):
+    if code == 0:
+      return 0.0
+    return math.exp((int(code) - 1) / self.scale + self.log_min)
+
+
+class NodeIndex:
+  """Node list of a component and its reverse lookup (node ID --> local index)
+  """
+
+  def __init__(self, nodes):
+    self.nodes = list(nodes)
+    self.index = dict((n, idx) for idx, n in enumerate(self.nodes))
+
+  def __len__(self):
+    return len(self.nodes)
+
+  def __contains__(self, n):
+    return n in self.index
+
+
+class DictScoreStore:
+  """Scores as dict of dicts (source --> destination --> score)
+  """
+
+  def __init__(self):
+    self.mat = dict()
+
+  def has_source(self, src):
+    return src in self.mat
+
+  def sources(self):
+    return self.mat.keys()
+
+  def get_dsts(self, src):
+    if not src in self.mat:
+      return set()
+    return self.mat[src].keys()
+
+  def get_value(self, src, dst):
+    row = self.mat.get(src)
+    if row is None:
+      return 0.0
+    return row.get(dst, 0.0)
+
+  def get_vector(self, src):
+    """Get the node index and the score vector of the source
+
+    :return: Tuple of NodeIndex and score vector, or None if not computed
+    """
+    row = self.mat.get(src)
+    if row is None:
+      return None
+    return NodeIndex(row.keys()), np.fromiter(row.values(), dtype=float, count=len(row))
+
+  def set_values(self, src, value_map):
+    if not src in self.mat:
+      self.mat[src] = dict()
+    self.mat[src].update(value_map)
+
+  def set_value(self, src, dst, value):
+    self.set_values(src, {dst: value})
+
+  def set_vector(self, src, node_index, vector):
+    """Store a dense score vector ordered by the node list of the component
+
+    :type node_index: NodeIndex
+    """
+    self.mat[src] = dict(zip(node_index.nodes, vector.tolist()))
+
+  def set_sparse(self, src, node_index, indices, values):
+    """Store scores of selected destinations only
+
+    :param indices: Local indices of the destinations in node_index
+    """
+    nodes = node_index.nodes
+    self.mat[src] = dict((nodes[idx], value) for idx, value in zip(indices.tolist(), values.tolist()))
+
+  def remove(self, src):
+    self.mat.pop(src, None)
+
+  def num_entries(self):
+    return sum(len(row) for row in self.mat.values())
+
+
+class _Block:
+  """Score rows of the sources in one component
+  """
+
+  def __init__(self, node_index, dtype):
+    self.node_index = node_index
+    self.data = np.zeros((INIT_ROWS, len(node_index)), dtype=dtype)
+    self.rows = dict()  # Source --> row
+    self.free = list()  # Released rows
+
+  def put(self, src, vector):
+    row = self.rows.get(src)
+    if row is None:
+      row = self.free.pop() if self.free else len(self.rows)
+      if row >= self.data.shape[0]:  # Double the capacity
+        data = np.zeros((self.data.shape[0] * 2, self.data.shape[1]), dtype=self.data.dtype)
+        data[:self.data.shape[0]] = self.data
+        self.data = data
+      self.rows[src] = row
+    self.data[row] = vector
+
+  def drop(self, src):
+    row = self.rows.pop(src)
+    self.free.append(row)
+    self.data[row] = 0.0
+
+  def nbytes(self):
+    return self.data.nbytes
+
+
+class ArrayScoreStore:
+  """Scores as per-component NumPy arrays (rows: sources, columns: node index of the component)
+  """
+
+  def __init__(self, dtype=np.float64, codec=None):
+    """
+    :param dtype: Data type of scores (e.g. np.float32 to halve the memory)
+    :param codec: Codec of stored scores such as LogQuantizer (scores are stored as codec.dtype)
+    """
+    self.dtype = dtype
+    self.codec = codec
+    self.blocks = dict()  # id(NodeIndex) --> _Block
+    self.owner = dict()   # Source --> _Block
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.blocks = dict((id(b.node_index), b) for b in self.blocks.values())  # Object IDs change after unpickling
+
+  def _block(self, node_index):
+    block = self.blocks.get(id(node_index))
+    if block is None:
+      block = _Block(node_index, self.storage_dtype())
+      self.blocks[id(node_index)] = block
+    return block
+
+  def has_source(self, src):
+    return src in self.owner
+
+  def sources(self):
+    return self.owner.keys()
+
+  def get_dsts(self, src):
+    block = self.owner.get(src)
+    if block is None:
+      return set()
+    return block.node_index.nodes
+
+  def get_value(self, src, dst):
+    block = self.owner.get(src)
+    if block is None:
+      return 0.0
+    idx = block.node_index.index.get(dst)
+    if idx is None:
+      return 0.0
+    if self.codec is not None:
+      return self.codec.decode_one(block.data[block.rows[src], idx])
+    return float(block.data[block.rows[src], idx])
+
+  def get_vector(self, src):
+    """Get the node index and the score vector of the source
+
+    :return: Tuple of NodeIndex and score vector, or None if not computed
+    """
+    block = self.owner.get(src)
+    if block is None:
+      return None
+    if self.codec is not None:
+      return block.node_index, self.codec.decode(block.data[block.rows[src]])
+    return block.node_index, block.data[block.rows[src]]
+
+  def set_vector(self, src, node_index, vector, encoded=False):
+    """Store a dense score vector ordered by the node list of the component
+
+    :type node_index: NodeIndex
+    :param encoded: The vector is already encoded with the codec
+    """
+    block = self.owner.get(src)
+    if block is not None and block.node_index is not node_index:  # Component has changed
+      self.remove(src)
+      block = None
+    if block is None:
+      block = self._block(node_index)
+      self.owner[src] = block
+    if self.codec is not None and not encoded:
+      vector = self.codec.encode(vector)
+    block.put(src, vector)
+
+  def set_sparse(self, src, node_index, indices, values, encoded=False):
+    """Store scores of selected destinations only (other destinations of the component become 0.0)
+    """
+    vector = np.zeros(len(node_index), dtype=self.storage_dtype() if encoded else self.dtype)
+    vector[indices] = values
+    self.set_vector(src, node_index, vector, encoded)
+
+  def set_values(self, src, value_map):
+    current = self.get_vector(src)
+    if current is not None and self.codec is None and all(dst in current[0] for dst in value_map):
+      node_index, vector = current
+      for dst, value in value_map.items():
+        vector[node_index.index[dst]] = value
+      return
+
+    ## Merge with previous scores into a new node index
+    prev = dict()
+    if current is not None:
+      prev = dict(zip(current[0].nodes, current[1].tolist()))
+    prev.update(value_map)
+    node_index = NodeIndex(prev.keys())
+    self.set_vector(src, node_index, np.fromiter(prev.values(), dtype=self.dtype, count=len(prev)))
+
+  def set_value(self, src, dst, value):
+    self.set_values(src, {dst: value})
+
+  def remove(self, src):
+    block = self.owner.pop(src, None)
+    if block is None:
+      return
+    block.drop(src)
+    if not block.rows:
+      del self.blocks[id(block.node_index)]
+
+  def storage_dtype(self):
+    return self.dtype if self.codec is None else self.codec.dtype
+  
+  def nbytes(self):
+    return sum(b.nbytes() for b in self.blocks.values())
+
+  def num_entries(self):
+    return sum(len(b.rows) * len(b.node_index) for b in self.blocks.values())
+
+
+class SparseScoreStore:
+  """Scores of selected destinations (source --> sorted local indices and scores in the component)
+  """
+
+  def __init__(self, dtype=np.float64, codec=None):
+    """
+    :param dtype: Data type of scores (e.g. np.float32 to halve the memory)
+    :param codec: Codec of stored scores such as LogQuantizer (scores are stored as codec.dtype)
+    """
+    self.dtype = dtype
+    self.codec = codec
+    self.rows = dict()  # Source --> (NodeIndex, indices, values)
+
+  def has_source(self, src):
+    return src in self.rows
+
+  def sources(self):
+    return self.rows.keys()
+
+  def get_dsts(self, src):
+    row = self.rows.get(src)
+    if row is None:
+      return set()
+    nodes = row[0].nodes
+    return [nodes[idx] for idx in row[1].tolist()]
+
+  def get_value(self, src, dst):
+    row = self.rows.get(src)
+    if row is None:
+      return 0.0
+    node_index, indices, values = row
+    idx = node_index.index.get(dst)
+    if idx is None:
+      return 0.0
+    pos = np.searchsorted(indices, idx)
+    if pos < len(indices) and indices[pos] == idx:
+      if self.codec is not None:
+        return self.codec.decode_one(values[pos])
+      return float(values[pos])
+    return 0.0
+
+  def get_vector(self, src):
+    """Get the node index and the dense score vector of the source
+
+    :return: Tuple of NodeIndex and score vector, or None if not computed
+    """
+    row = self.rows.get(src)
+    if row is None:
+      return None
+    node_index, indices, values = row
+    vector = np.zeros(len(node_index), dtype=self.dtype)
+    vector[indices] = values if self.codec is None else self.codec.decode(values)
+    return node_index, vector
+
+  def get_sparse(self, src):
+    """Get the stored scores of the source without expanding them into a dense vector
+
+    :return: Tuple of NodeIndex, sorted local indices and scores, or None if not computed
+    """
+    row = self.rows.get(src)
+    if row is None:
+      return None
+    node_index, indices, values = row
+    return node_index, indices, values if self.codec is None else self.codec.decode(values)
+
+  def set_sparse(self, src, node_index, indices, values, encoded=False):
+    """Store scores of selected destinations only
+
+    :param indices: Local indices of the destinations in node_index
+    :param encoded: The values are already encoded with the codec
+    """
+    order = np.argsort(indices, kind="stable")
+    if self.codec is not None and not encoded:
+      values = self.codec.encode(values)
+    self.rows[src] = (node_index, np.asarray(indices, dtype=np.int32)[order],
+                      np.asarray(values, dtype=self.storage_dtype())[order])
+
+  def set_vector(self, src, node_index, vector, encoded=False):
+    self.set_sparse(src, node_index, np.arange(len(node_index)), vector, encoded)
+
+  def set_values(self, src, value_map):
+    current = dict()
+    row = self.rows.get(src)
+    if row is not None:
+      nodes = row[0].nodes
+      values = row[2] if self.codec is None else self.codec.decode(row[2])
+      current = dict((nodes[idx], value) for idx, value in zip(row[1].tolist(), values.tolist()))
+    current.update(value_map)
+    node_index = NodeIndex(current.keys())
+    self.set_vector(src, node_index, np.fromiter(current.values(), dtype=self.dtype, count=len(current)))
+
+  def set_value(self, src, dst, value):
+    self.set_values(src, {dst: value})
+
+  def remove(self, src):
+    self.rows.pop(src, None)
+
+  def storage_dtype(self):
+    return self.dtype if self.codec is None else self.codec.dtype
+  
+  def nbytes(self):
+    return sum(row[1].nbytes + row[2].nbytes for row in self.rows.values())
+
+  def num_entries(self):
+    return sum(len(row[1]) for row in self.rows.values())